@@ -0,0 +1,206 @@
+"""
+Control de admisión de las conversiones.
+
+Cada conversión arma el documento en el proceso del servidor y prepara las
+imágenes en su propio pool de procesos (pipeline.py), así que varios lotes
+grandes a la vez pueden agotar la memoria. AdmissionController limita cuántas
+conversiones corren a la vez (slots) y cuántas esperan turno, en cantidad y
+en bytes subidos.
+
+El lugar en la cola se reserva con el Content-Length, antes de leer el cuerpo
+de la petición: si la cola está llena la petición se rechaza enseguida
+(Overloaded, que app.py responde con 503 y Retry-After) sin recibir las
+imágenes. Las imágenes ya subidas por partes que referencia la petición se
+suman después, al leer el formulario (Ticket.add_bytes). El turno se espera después, ya con las imágenes guardadas, en orden
+de llegada. Los límites son por proceso.
+"""
+from collections import deque
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+# Conversiones simultáneas por proceso (cada una ya usa su propio pool de procesos)
+DEFAULT_SLOTS = 2
+
+# Conversiones que pueden esperar turno además de las que corren
+DEFAULT_QUEUE = 8
+
+# Bytes subidos que pueden esperar en memoria/disco entre todas las conversiones
+DEFAULT_QUEUE_BYTES = 1024 * 1024 * 1024
+
+# Segundos máximos que una petición de /convert espera turno
+DEFAULT_QUEUE_TIMEOUT = 60
+
+# Duración supuesta de una conversión mientras no se midió ninguna (para Retry-After)
+DEFAULT_CONVERSION_SECONDS = 10
+
+# Estados de un Ticket
+WAITING, RUNNING, FINISHED, RELEASED = 'waiting', 'running', 'finished', 'released'
+
+
+class Overloaded(Exception):
+    """No hay lugar para la conversión; retry_after son los segundos sugeridos para reintentar"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    Lugar reservado en la cola de un AdmissionController. acquire() espera el
+    turno y finish() lo libera; release() devuelve además el lugar y los bytes
+    reservados. Todos se pueden llamar de más.
+    """
+
+    def __init__(self, controller, size):
+        self.controller = controller
+        self.size = size
+        self.state = WAITING
+        self.started = None
+
+    def add_bytes(self, size):
+        """
+        Reserva además size bytes (imágenes que la petición no trae en el
+        cuerpo); lanza Overloaded si no entran, con el mismo criterio que reserve
+        """
+        self.controller._add_bytes(self, size)
+
+    def acquire(self, timeout=None):
+        """Espera turno para convertir; lanza Overloaded si pasan timeout segundos"""
+        self.controller._acquire(self, timeout)
+
+    def finish(self):
+        """Termina la conversión y cede el turno a la siguiente"""
+        self.controller._finish(self)
+
+    def release(self):
+        """Devuelve el lugar en la cola y los bytes reservados"""
+        self.controller._release(self)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Ejecuta el bloque con turno (usar con with)"""
+        self.acquire(timeout)
+        try:
+            yield self
+        finally:
+            self.finish()
+
+
+class AdmissionController:
+    """Limita las conversiones simultáneas y la cola que espera turno"""
+
+    def __init__(self, slots=DEFAULT_SLOTS, queue=DEFAULT_QUEUE, queue_bytes=DEFAULT_QUEUE_BYTES):
+        self.slots = max(1, slots)
+        self.queue = max(0, queue)
+        self.queue_bytes = queue_bytes
+        self.active = 0
+        self.waiting = 0
+        self.reserved_bytes = 0
+        self.rejected = 0
+        self.closed = False
+        # Promedio móvil de la duración de una conversión, para Retry-After
+        self._seconds = None
+        self._line = deque()
+        self._cond = threading.Condition()
+
+    def reserve(self, size):
+        """
+        Reserva un lugar para una conversión de size bytes subidos y retorna su
+        Ticket. Lanza Overloaded si la cola está llena o el servidor se cierra.
+        Una petición sola siempre se admite, aunque pase de queue_bytes.
+        """
+        with self._cond:
+            # Las que van a tener turno enseguida no cuentan como cola
+            free = max(0, self.slots - self.active)
+            if self.closed:
+                message = 'El servidor se está cerrando'
+            elif self.waiting >= self.queue + free:
+                message = 'Hay demasiadas conversiones en espera'
+            elif self.reserved_bytes and self.reserved_bytes + size > self.queue_bytes:
+                message = 'Hay demasiadas imágenes en espera'
+            else:
+                self.waiting += 1
+                self.reserved_bytes += size
+                return Ticket(self, size)
+            self.rejected += 1
+            raise Overloaded(message, self._retry_after())
+
+    def close(self):
+        """Rechaza las nuevas reservas (cierre ordenado); las ya admitidas siguen"""
+        with self._cond:
+            self.closed = True
+
+    def wait_idle(self, timeout=None):
+        """Espera a que terminen y se liberen todas las conversiones admitidas"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not (self.active or self.waiting), timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'active': self.active,
+                'waiting': self.waiting,
+                'reserved_bytes': self.reserved_bytes,
+                'rejected': self.rejected,
+            }
+
+    def _retry_after(self):
+        # Tandas de conversiones por delante de una petición nueva, por lo que dura cada una
+        seconds = self._seconds if self._seconds is not None else DEFAULT_CONVERSION_SECONDS
+        rounds = (self.active + self.waiting) // self.slots + 1
+        return max(1, math.ceil(seconds * rounds))
+
+    def _add_bytes(self, ticket, size):
+        with self._cond:
+            if ticket.state == RELEASED or size <= 0:
+                return
+            # Como en reserve: una petición sola siempre entra
+            others = self.reserved_bytes - ticket.size
+            if others and self.reserved_bytes + size > self.queue_bytes:
+                self.rejected += 1
+                raise Overloaded('Hay demasiadas imágenes en espera', self._retry_after())
+            ticket.size += size
+            self.reserved_bytes += size
+
+    def _acquire(self, ticket, timeout):
+        with self._cond:
+            if ticket.state != WAITING:
+                return
+            # En orden de llegada: espera a que haya turno y sea la primera de la fila
+            self._line.append(ticket)
+            ready = self._cond.wait_for(
+                lambda: self.active < self.slots and self._line[0] is ticket, timeout)
+            self._line.remove(ticket)
+            if not ready:
+                self._cond.notify_all()
+                raise Overloaded('Se agotó la espera de turno para convertir', self._retry_after())
+            self.waiting -= 1
+            self.active += 1
+            ticket.state = RUNNING
+            ticket.started = time.monotonic()
+            self._cond.notify_all()
+
+    def _finish(self, ticket):
+        with self._cond:
+            if ticket.state != RUNNING:
+                return
+            seconds = time.monotonic() - ticket.started
+            self._seconds = seconds if self._seconds is None else 0.8 * self._seconds + 0.2 * seconds
+            self.active -= 1
+            ticket.state = FINISHED
+            self._cond.notify_all()
+
+    def _release(self, ticket):
+        self._finish(ticket)
+        with self._cond:
+            if ticket.state == RELEASED:
+                return
+            if ticket.state == WAITING:
+                self.waiting -= 1
+            self.reserved_bytes -= ticket.size
+            ticket.state = RELEASED
+            self._cond.notify_all()
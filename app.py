@@ -1,404 +1,551 @@
-from flask import Flask, render_template, request, send_file, jsonify
-from docx import Document
-from docx.shared import Mm, Pt, RGBColor
-from docx.enum.table import WD_ROW_HEIGHT_RULE, WD_CELL_VERTICAL_ALIGNMENT
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from PIL import Image
-from PIL.ExifTags import TAGS
+from flask import Flask, Request, g, render_template, request, send_file, jsonify, url_for
+from werkzeug.wsgi import ClosingIterator
+import functools
+import io
 import os
 import tempfile
 import shutil
 from datetime import datetime
 import uuid
 import re
+import json
+import time
+import zipfile
+
+from admission import (DEFAULT_QUEUE, DEFAULT_QUEUE_BYTES, DEFAULT_QUEUE_TIMEOUT, DEFAULT_SLOTS,
+                       AdmissionController, Overloaded)
+from image_prep import DEFAULT_PROFILE, QUALITY_PROFILES
+from layout import DEFAULT_GRID, get_grid
+from converter import allowed_file, build_image_records, convert_images
+from docx_writer import zip_info
+from image_cache import DEFAULT_CACHE_BYTES, ImageCache
+from image_source import MemoryImage
+from upload_store import DEFAULT_UPLOAD_TTL, UploadOffsetError, UploadStore, is_digest
+from result_store import DEFAULT_RESULT_BYTES, ResultStore, result_key
+from jobs import DEFAULT_JOB_TTL, DEFAULT_JOB_WORKERS, DONE, FAILED, JobStore
+from metrics import METRICS, SlowRequestProfiler
+from pipeline import DEFAULT_WORKERS, StageTimer
+
+class UploadRequest(Request):
+    """
+    Recibe los archivos de las peticiones de hasta UPLOAD_MEMORY_MB en memoria;
+    los de peticiones más grandes, directo en archivos temporales en disco
+    (que save_uploads enlaza sin copiar)
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if (total_content_length is not None
+                and total_content_length <= app.config['UPLOAD_MEMORY_MB'] * 1024 * 1024):
+            return io.BytesIO()
+        return tempfile.NamedTemporaryFile('w+b', prefix='upload-')
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max total
+# Peticiones de hasta este tamaño se procesan sin escribir las imágenes a disco
+app.config['UPLOAD_MEMORY_MB'] = int(os.environ.get('UPLOAD_MEMORY_MB', 64))
+# Procesos para preparar imágenes en paralelo (1 = en serie)
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', DEFAULT_WORKERS))
+# Escribir el .docx imagen por imagen en lugar de armarlo completo en memoria
+app.config['STREAMING_DOCX'] = os.environ.get('STREAMING_DOCX', '1') != '0'
+# Conversiones en segundo plano (/jobs) simultáneas y segundos que se conservan sus resultados
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', DEFAULT_JOB_WORKERS))
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', DEFAULT_JOB_TTL))
+# Conversiones simultáneas por proceso (/convert, /jobs y /analyze_metadata), cuántas
+# pueden esperar turno y con cuántos MB subidos, y segundos que /convert espera turno
+app.config['CONVERT_SLOTS'] = int(os.environ.get('CONVERT_SLOTS', DEFAULT_SLOTS))
+app.config['CONVERT_QUEUE'] = int(os.environ.get('CONVERT_QUEUE', DEFAULT_QUEUE))
+app.config['CONVERT_QUEUE_MB'] = int(os.environ.get('CONVERT_QUEUE_MB', DEFAULT_QUEUE_BYTES // (1024 * 1024)))
+app.config['CONVERT_QUEUE_TIMEOUT'] = int(os.environ.get('CONVERT_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT))
+
+# Caché en disco de imágenes preparadas (IMAGE_CACHE_MB=0 lo desactiva)
+app.config['IMAGE_CACHE_DIR'] = os.environ.get(
+    'IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'imagenes-a-word-cache'))
+app.config['IMAGE_CACHE_MB'] = int(os.environ.get('IMAGE_CACHE_MB', DEFAULT_CACHE_BYTES // (1024 * 1024)))
+
+# Imágenes subidas por partes (/uploads), referenciadas por hash en las conversiones
+app.config['UPLOAD_DIR'] = os.environ.get(
+    'UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'imagenes-a-word-uploads'))
+app.config['UPLOAD_TTL'] = int(os.environ.get('UPLOAD_TTL', DEFAULT_UPLOAD_TTL))
 
-# Extensiones válidas de imagen
-VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
+# Documentos ya generados por /convert, servidos por su ETag sin volver a armarlos
+# (RESULT_STORE_MB=0 lo desactiva)
+app.config['RESULT_DIR'] = os.environ.get(
+    'RESULT_DIR', os.path.join(tempfile.gettempdir(), 'imagenes-a-word-results'))
+app.config['RESULT_STORE_MB'] = int(os.environ.get('RESULT_STORE_MB', DEFAULT_RESULT_BYTES // (1024 * 1024)))
 
-def allowed_file(filename):
-    return os.path.splitext(filename.lower())[1] in VALID_EXTENSIONS
+# Carpeta para los perfiles cProfile de las peticiones más lentas (vacío = sin perfilado)
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', '')
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 5))
 
-def extract_image_metadata(filepath):
+jobs = JobStore(app.config['JOB_WORKERS'], app.config['JOB_TTL'])
+admission = AdmissionController(
+    app.config['CONVERT_SLOTS'], app.config['CONVERT_QUEUE'], app.config['CONVERT_QUEUE_MB'] * 1024 * 1024)
+profiler = None
+if app.config['PROFILE_DIR']:
+    profiler = SlowRequestProfiler(app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'])
+upload_store = UploadStore(app.config['UPLOAD_DIR'], app.config['UPLOAD_TTL'])
+image_cache = None
+if app.config['IMAGE_CACHE_MB'] > 0:
+    image_cache = ImageCache(app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_MB'] * 1024 * 1024)
+result_store = None
+if app.config['RESULT_STORE_MB'] > 0:
+    result_store = ResultStore(app.config['RESULT_DIR'], app.config['RESULT_STORE_MB'] * 1024 * 1024)
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+ZIP_MIMETYPE = 'application/zip'
+
+METRICS.describe('jobs', 'Trabajos de /jobs por estado (queued = profundidad de la cola)', 'gauge')
+METRICS.gauge('jobs', lambda: [({'status': status}, count) for status, count in jobs.counts().items()])
+METRICS.describe('conversions', 'Conversiones admitidas por estado (waiting = esperan turno)', 'gauge')
+METRICS.gauge('conversions', lambda: [({'state': 'active'}, admission.active), ({'state': 'waiting'}, admission.waiting)])
+METRICS.describe('conversion_queue_bytes', 'Bytes subidos reservados por las conversiones admitidas', 'gauge')
+METRICS.gauge('conversion_queue_bytes', lambda: admission.reserved_bytes)
+METRICS.describe('conversions_rejected_total', 'Conversiones rechazadas con 503 (cola llena)', 'counter')
+METRICS.gauge('conversions_rejected_total', lambda: admission.rejected)
+if image_cache is not None:
+    METRICS.describe('cache_hits_total', 'Aciertos del caché de imágenes', 'counter')
+    METRICS.gauge('cache_hits_total', lambda: image_cache.hits)
+    METRICS.describe('cache_misses_total', 'Fallos del caché de imágenes', 'counter')
+    METRICS.gauge('cache_misses_total', lambda: image_cache.misses)
+    METRICS.describe('cache_evictions_total', 'Entradas expulsadas del caché de imágenes', 'counter')
+    METRICS.gauge('cache_evictions_total', lambda: image_cache.evictions)
+if result_store is not None:
+    METRICS.describe('result_hits_total', 'Conversiones servidas desde el almacén de resultados', 'counter')
+    METRICS.gauge('result_hits_total', lambda: result_store.hits)
+    METRICS.describe('result_misses_total', 'Conversiones que no estaban en el almacén de resultados', 'counter')
+    METRICS.gauge('result_misses_total', lambda: result_store.misses)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.profile = None
+    # Perfilado opcional por petición (?profile=1), si PROFILE_DIR está configurado. Solo
+    # la query string: leer el formulario recibiría el cuerpo antes de que @admitted reserve lugar
+    if profiler is not None and request.args.get('profile') == '1':
+        g.profile = profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    seconds = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unknown'
+    METRICS.inc('requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    METRICS.observe('request_seconds', seconds, endpoint=endpoint)
+    if g.get('profile') is not None:
+        path = profiler.stop(g.profile, request.endpoint or 'request', seconds)
+        g.profile = None
+        if path:
+            app.logger.info(f"Perfil de {endpoint} ({seconds:.2f}s) guardado en {path}")
+    return response
+
+def overloaded_response(error):
+    """503 con Retry-After para una conversión sin lugar (ver admission.py)"""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def admitted(view):
     """
-    Extrae metadata de una imagen (EXIF, nombre del archivo, fecha de modificación)
-    Retorna un diccionario con la información disponible
+    Reserva un lugar en la cola de conversiones antes de leer el cuerpo de la
+    petición (con su Content-Length) y responde 503 si no hay. El Ticket queda
+    en g.admission y se libera al terminar la vista, salvo que esta lo saque
+    de g para pasárselo a un trabajo
     """
-    metadata = {
-        'sender': None,
-        'datetime': None,
-        'filename': os.path.basename(filepath),
-        'file_mtime': None
-    }
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            g.admission = admission.reserve(request.content_length or 0)
+        except Overloaded as e:
+            return overloaded_response(e)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            ticket = g.pop('admission', None)
+            if ticket is not None:
+                ticket.release()
+    return wrapper
+
+def shutdown(timeout=None):
+    """
+    Cierre ordenado: rechaza nuevas conversiones y espera hasta timeout segundos
+    a que terminen las admitidas, incluidos los trabajos de /jobs en cola.
+    Retorna True si terminaron todas
+    """
+    admission.close()
+    return admission.wait_idle(timeout)
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+def read_uploads():
+    """
+    Lee las imágenes del formulario: archivos en 'images' y/o referencias a
+    imágenes ya subidas por partes en 'blobs' (JSON [{"name": ..., "hash": ...}])
+    Retorna: tupla (files, blob_refs, respuesta de error o None)
+    """
+    files = request.files.getlist('images')
+    blob_refs = []
     
-    try:
-        # Obtener fecha de modificación del archivo
-        file_stat = os.stat(filepath)
-        metadata['file_mtime'] = datetime.fromtimestamp(file_stat.st_mtime)
+    if 'images' not in request.files and 'blobs' not in request.form:
+        return files, blob_refs, (jsonify({'error': 'No se encontraron imágenes'}), 400)
+    
+    if 'blobs' in request.form:
+        try:
+            blob_refs = json.loads(request.form['blobs'])
+        except ValueError:
+            blob_refs = None
+        if not isinstance(blob_refs, list) or not all(
+                isinstance(ref, dict) and isinstance(ref.get('name'), str) and is_digest(ref.get('hash'))
+                for ref in blob_refs):
+            return files, [], (jsonify({'error': 'Lista de imágenes subidas no válida'}), 400)
         
-        # Intentar extraer información del nombre del archivo
-        # WhatsApp suele guardar imágenes como: IMG-20231225-WA0001.jpg
-        # O con formato de timestamp
-        filename = os.path.basename(filepath)
+        missing = [ref['hash'] for ref in blob_refs if not upload_store.has(ref['hash'])]
+        if missing:
+            return files, blob_refs, (jsonify({'error': 'Faltan imágenes por subir', 'missing': missing}), 409)
         
-        # Buscar patrones de WhatsApp en el nombre
-        # Patrón: IMG-YYYYMMDD-WA####
-        wsp_pattern = r'IMG-(\d{8})-WA\d+'
-        match = re.search(wsp_pattern, filename)
-        if match:
-            date_str = match.group(1)
+        # Las imágenes ya subidas no cuentan en el Content-Length: se suman a
+        # los bytes reservados en la cola (ver admitted)
+        ticket = g.get('admission')
+        if ticket is not None:
             try:
-                metadata['datetime'] = datetime.strptime(date_str, '%Y%m%d')
-            except:
-                pass
-        
-        # Intentar leer EXIF data
-        with Image.open(filepath) as img:
-            exif_data = img._getexif()
-            
-            if exif_data:
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    
-                    # Buscar fecha/hora original
-                    if tag == 'DateTimeOriginal' or tag == 'DateTime':
-                        try:
-                            metadata['datetime'] = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                        except:
-                            pass
-                    
-                    # Buscar información del autor/creador
-                    elif tag == 'Artist' or tag == 'Author':
-                        metadata['sender'] = value
-                    
-                    # XPAuthor (Windows)
-                    elif tag == 'XPAuthor':
-                        try:
-                            metadata['sender'] = value.decode('utf-16le').rstrip('\x00')
-                        except:
-                            pass
-                    
-                    # UserComment puede contener información adicional
-                    elif tag == 'UserComment':
-                        try:
-                            if isinstance(value, bytes):
-                                comment = value.decode('utf-8', errors='ignore')
-                                metadata['sender'] = comment
-                        except:
-                            pass
-        
-        # Si no encontramos fecha en EXIF, usar la fecha de modificación
-        if not metadata['datetime']:
-            metadata['datetime'] = metadata['file_mtime']
-            
-    except Exception as e:
-        print(f"Error extrayendo metadata de {filepath}: {e}")
+                ticket.add_bytes(sum(upload_store.received(ref['hash']) for ref in blob_refs))
+            except Overloaded as e:
+                return files, blob_refs, overloaded_response(e)
     
-    return metadata
+    if not blob_refs and (not files or all(f.filename == '' for f in files)):
+        return files, blob_refs, (jsonify({'error': 'No se seleccionaron archivos'}), 400)
+    return files, blob_refs, None
 
-def sort_images_by_metadata(file_list):
+def save_uploads(files, temp_dir, blob_refs=()):
     """
-    Ordena imágenes solo por fecha/hora
-    file_list: lista de tuplas (filename, filepath)
-    Retorna: tupla (lista ordenada de filepath, lista de metadata completa)
+    Reúne las imágenes válidas. Las que llegaron en memoria (ver UploadRequest)
+    se usan tal cual, como image_source.MemoryImage; las que llegaron a disco y
+    las ya subidas por partes se enlazan en temp_dir, sin copiarlas. Cada imagen
+    tiene su propia clave numerada (y su subcarpeta), así dos archivos con el
+    mismo nombre, p. ej. de carpetas distintas, no se pisan.
+    Retorna lista de (filename, filepath)
     """
-    images_with_metadata = []
+    saved_files = []
     
-    for filename, filepath in file_list:
-        metadata = extract_image_metadata(filepath)
-        images_with_metadata.append({
-            'filepath': filepath,
-            'filename': filename,
-            'sender': metadata['sender'] or 'Unknown',
-            'datetime': metadata['datetime'] or datetime(1970, 1, 1),
-            'metadata': metadata  # Mantener metadata completa
-        })
-    
-    # Ordenar solo por datetime (fecha/hora de envío)
-    sorted_images = sorted(images_with_metadata, key=lambda x: x['datetime'])
+    def unique_path(filename):
+        folder = os.path.join(temp_dir, f"{len(saved_files):05d}")
+        os.mkdir(folder)
+        return os.path.join(folder, filename)
     
-    return [img['filepath'] for img in sorted_images], images_with_metadata
+    for file in files:
+        if file and file.filename and allowed_file(file.filename):
+            # Mantener nombre original para ordenar
+            filename = file.filename
+            name = os.path.basename(filename.replace('\\', '/'))
+            if isinstance(file.stream, io.BytesIO):
+                filepath = MemoryImage(f"{len(saved_files):05d}", name, file.stream.getvalue())
+            else:
+                filepath = unique_path(name)
+                try:
+                    file.stream.flush()
+                    os.link(file.stream.name, filepath)
+                except (AttributeError, OSError):
+                    file.save(filepath)
+            saved_files.append((filename, filepath))
+    for ref in blob_refs:
+        filename = os.path.basename(ref['name'])
+        if filename and allowed_file(filename):
+            filepath = unique_path(filename)
+            upload_store.link(ref['hash'], filepath)
+            saved_files.append((filename, filepath))
+    return saved_files
+
+def output_mimetype(filename):
+    """Tipo de contenido del resultado: .docx, o .zip con varios volúmenes"""
+    return ZIP_MIMETYPE if filename.endswith('.zip') else DOCX_MIMETYPE
 
-def images_to_word(image_paths, output_file, mode='standard', images_metadata=None):
+def zip_volumes(volume_paths, zip_path):
     """
-    Convierte una lista de imágenes a un documento Word
-    
-    Args:
-        image_paths: Lista de rutas de archivos de imagen
-        output_file: Ruta del archivo de salida .docx
-        mode: 'standard' (1 por página) o 'receipts' (grid 2x2)
-        images_metadata: Lista opcional de diccionarios con metadata para cada imagen
+    Junta los volúmenes en un .zip (sin comprimir: un .docx ya está comprimido)
+    y borra cada volumen apenas se agrega. Las entradas llevan la misma fecha
+    fija que las del .docx, así el .zip también es reproducible
     """
-    document = Document()
-    
-    # Crear un mapa de filepath -> metadata para búsqueda rápida
-    metadata_map = {}
-    if images_metadata:
-        for img_data in images_metadata:
-            metadata_map[img_data['filepath']] = img_data
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as archive:
+        for path in volume_paths:
+            info = zip_info(os.path.basename(path), zipfile.ZIP_STORED)
+            info.file_size = os.path.getsize(path)
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            os.remove(path)
+
+def convert_saved_files(saved_files, temp_dir, options, timer, progress=None, output_name=None):
+    """
+    Ordena las imágenes ya guardadas y genera el documento en temp_dir
+    options: opciones de read_convert_options (mode, sort_by, quality, grid, limits)
+    progress: callback opcional de converter.convert_images
+    output_name: nombre del resultado sin extensión (por defecto, con la fecha)
+    Retorna: tupla (output_path, output_filename, procesadas, errores,
+    imágenes con la fecha de modificación del archivo en el pie); con
+    límites de volumen y más de un volumen, output_path es un .zip con todos
+    """
+    # Generar documento Word
+    if output_name is None:
+        output_name = f"documento_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    output_path = os.path.join(temp_dir, output_name + '.docx')
     
-    # Configurar márgenes según el modo
-    section = document.sections[0]
+    volumes, processed, errors, mtime_dates = convert_images(
+        saved_files, output_path, options['mode'], options['sort_by'], options['quality'], options['grid'],
+        app.config['IMAGE_WORKERS'], timer, app.config['STREAMING_DOCX'], progress, image_cache,
+        limits=options['limits']
+    )
+    if len(volumes) > 1:
+        output_path = os.path.join(temp_dir, output_name + '.zip')
+        with timer.stage('zip'):
+            zip_volumes(volumes, output_path)
+    output_filename = os.path.basename(output_path)
+    app.logger.info(f"Conversión de {len(saved_files)} imágenes: {timer.report()}")
+    for error in errors:
+        app.logger.warning(f"Imagen no procesada: {error}")
+    METRICS.observe_timer(timer)
+    if image_cache is not None:
+        image_cache.evict()
+    return output_path, output_filename, processed, errors, mtime_dates
+
+def read_convert_options():
+    """
+    Lee las opciones de conversión del formulario
+    Retorna: tupla (files, blob_refs, opciones, respuesta de error o None)
+    """
+    files, blob_refs, error = read_uploads()
+    options = {
+        'mode': request.form.get('mode', 'standard'),
+        'sort_by': request.form.get('sort_by', 'name'),  # 'name' o 'metadata'
+        'quality': request.form.get('quality', DEFAULT_PROFILE),  # 'print', 'screen' o 'original'
+        'grid': request.form.get('grid', DEFAULT_GRID),  # cuadrícula del modo recibos
+        'limits': None,
+    }
     
-    if mode == 'standard':
-        # Modo estándar con márgenes normales
-        section.left_margin = Mm(10)
-        section.right_margin = Mm(10)
-        section.top_margin = Mm(10)
-        section.bottom_margin = Mm(10)
-    else:
-        # Modo recibos: SIN MÁRGENES (100% de la hoja)
-        section.left_margin = Mm(0)
-        section.right_margin = Mm(0)
-        section.top_margin = Mm(0)
-        section.bottom_margin = Mm(0)
-
-    # Dimensiones de página
-    page_width = section.page_width
-    page_height = section.page_height
+    # Límites por volumen (vacío o 0 = sin límite); al pasarlos se generan varios documentos
+    limits = {}
+    for field, key, scale in (('max_pages', 'max_pages', 1), ('max_images', 'max_images', 1),
+                              ('max_mb', 'max_bytes', 1024 * 1024)):
+        value = request.form.get(field, '').strip()
+        if not value:
+            continue
+        try:
+            number = float(value) if field == 'max_mb' else int(value)
+        except ValueError:
+            number = -1
+        if number < 0:
+            if error is None:
+                error = jsonify({'error': f'Límite de volumen no válido: {field}={value}'}), 400
+            continue
+        if number:
+            limits[key] = int(number * scale)
+    options['limits'] = limits or None
     
-    # Calcular ancho y alto disponibles
-    available_width = page_width - section.left_margin - section.right_margin
-    available_height = page_height - section.top_margin - section.bottom_margin
-
-    processed = 0
-    errors = []
-
-    if mode == 'standard':
-        # MODO ESTÁNDAR: Priorizar visibilidad completa (generalmente 1 por página si son grandes)
-        for i, filepath in enumerate(image_paths):
-            try:
-                # Agregar salto de página antes (excepto en la primera imagen)
-                if i > 0:
-                    document.add_page_break()
-                
-                # Agregar fecha/hora si hay metadata disponible
-                if filepath in metadata_map:
-                    img_metadata = metadata_map[filepath]
-                    if img_metadata.get('datetime'):
-                        # Agregar párrafo con fecha y hora
-                        date_paragraph = document.add_paragraph()
-                        date_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        
-                        run = date_paragraph.add_run(
-                            img_metadata['datetime'].strftime('📅 %d/%m/%Y  🕐 %H:%M:%S')
-                        )
-                        run.font.size = Pt(11)
-                        run.font.bold = True
-                        run.font.color.rgb = RGBColor(102, 126, 234)  # Color morado
-                        
-                        # Espacio pequeño entre fecha e imagen
-                        date_paragraph.paragraph_format.space_after = Pt(6)
-                
-                # Agregar la imagen
-                with Image.open(filepath) as img:
-                    img_width, img_height = img.size
-                    aspect_ratio = img_width / img_height
-                    
-                    target_width = available_width
-                    target_height = int(target_width / aspect_ratio)
-                    
-                    if target_height > available_height:
-                        target_height = available_height
-                        target_width = int(target_height * aspect_ratio)
-                    
-                    document.add_picture(filepath, width=target_width, height=target_height)
-                    last_paragraph = document.paragraphs[-1]
-                    last_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    
-                    processed += 1
-            except Exception as e:
-                errors.append(f"{os.path.basename(filepath)}: {str(e)}")
-
-    else:
-        # MODO RECIBOS: Grid 2 columnas x 2 filas (4 imágenes por hoja)
-        # Crear tabla
-        table = document.add_table(rows=0, cols=2)
-        table.autofit = False 
-        
-        # Calcular dimensiones de celda para 2 columnas y 2 filas por página
-        col_width = available_width / 2
-        row_height = available_height / 2
-        
-        # Sin márgenes internos para ocupar toda la superficie
-        cell_margin = Mm(0)
-        
-        # Dimensiones máximas de imagen dentro de la celda (toda la celda)
-        max_img_width = col_width
-        max_img_height = row_height
-
-        current_row = None
-
-        for i, filepath in enumerate(image_paths):
-            try:
-                # Determinar columna (0 o 1)
-                col_idx = i % 2
-                
-                # Si es columna 0, crear nueva fila
-                if col_idx == 0:
-                    current_row = table.add_row()
-                    current_row.height = int(row_height)
-                    current_row.height_rule = WD_ROW_HEIGHT_RULE.EXACTLY
-                
-                cell = current_row.cells[col_idx]
-                cell.vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
-                cell.width = int(col_width)
-                
-                # Limpiar párrafo existente en la celda
-                paragraph = cell.paragraphs[0]
-                paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                
-                # Agregar fecha/hora si hay metadata disponible
-                if filepath in metadata_map:
-                    img_metadata = metadata_map[filepath]
-                    if img_metadata.get('datetime'):
-                        # Agregar texto con fecha y hora
-                        run = paragraph.add_run(
-                            img_metadata['datetime'].strftime('📅 %d/%m/%Y %H:%M\n')
-                        )
-                        run.font.size = Pt(8)
-                        run.font.bold = True
-                        run.font.color.rgb = RGBColor(102, 126, 234)
-                
-                # Procesar imagen
-                with Image.open(filepath) as img:
-                    img_width, img_height = img.size
-                    aspect_ratio = img_width / img_height
-                    
-                    # Calcular tamaño para llenar completamente la celda
-                    # Reservar espacio para el texto de fecha si existe
-                    available_cell_height = max_img_height
-                    if filepath in metadata_map and metadata_map[filepath].get('datetime'):
-                        available_cell_height = max_img_height - Mm(8)  # Reservar 8mm para la fecha
-                    
-                    target_width = max_img_width
-                    target_height = int(target_width / aspect_ratio)
-                    
-                    # Si es muy alta, ajustar por alto
-                    if target_height > available_cell_height:
-                        target_height = available_cell_height
-                        target_width = int(target_height * aspect_ratio)
-                    
-                    run = paragraph.add_run()
-                    run.add_picture(filepath, width=int(target_width), height=int(target_height))
-                    
-                processed += 1
-
-            except Exception as e:
-                errors.append(f"{os.path.basename(filepath)}: {str(e)}")
-
-    document.save(output_file)
-    return processed, errors
-
-@app.route('/')
-def index():
-    return render_template('index.html')
+    if error is None and options['quality'] not in QUALITY_PROFILES:
+        error = jsonify({'error': f"Perfil de calidad no válido: {options['quality']}"}), 400
+    if error is None:
+        try:
+            get_grid(options['grid'])
+        except ValueError as e:
+            error = jsonify({'error': str(e)}), 400
+    return files, blob_refs, options, error
 
 @app.route('/convert', methods=['POST'])
+@admitted
 def convert():
-    if 'images' not in request.files:
-        return jsonify({'error': 'No se encontraron imágenes'}), 400
-    
-    files = request.files.getlist('images')
-    mode = request.form.get('mode', 'standard')
-    sort_by = request.form.get('sort_by', 'name')  # 'name' o 'metadata'
-    
-    if not files or all(f.filename == '' for f in files):
-        return jsonify({'error': 'No se seleccionaron archivos'}), 400
+    files, blob_refs, options, error = read_convert_options()
+    if error:
+        return error
     
     # Crear directorio temporal
     temp_dir = tempfile.mkdtemp()
-    image_paths = []
+    timer = StageTimer()
     
     try:
         # Guardar archivos temporalmente
-        saved_files = []
-        for file in files:
-            if file and file.filename and allowed_file(file.filename):
-                # Mantener nombre original para ordenar
-                filename = file.filename
-                filepath = os.path.join(temp_dir, filename)
-                file.save(filepath)
-                saved_files.append((filename, filepath))
+        with timer.stage('upload'):
+            saved_files = save_uploads(files, temp_dir, blob_refs)
         
         if not saved_files:
+            shutil.rmtree(temp_dir, ignore_errors=True)
             return jsonify({'error': 'No se encontraron imágenes válidas'}), 400
         
-        # Ordenar según el método seleccionado
-        metadata_list = None
-        if sort_by == 'metadata':
-            # Ordenar por metadata (fecha/hora)
-            image_paths, metadata_list = sort_images_by_metadata(saved_files)
-        else:
-            # Ordenar por nombre de archivo (comportamiento original)
-            saved_files.sort(key=lambda x: x[0])
-            image_paths = [f[1] for f in saved_files]
-        
-        # Generar documento Word
-        output_filename = f"documento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-        output_path = os.path.join(temp_dir, output_filename)
+        # El documento es reproducible: la clave de la entrada (imágenes y
+        # opciones) es su ETag. Si el cliente ya lo tiene no se arma nada, y
+        # si ya se generó antes se sirve desde el almacén de resultados
+        with timer.stage('hash'):
+            key = result_key(saved_files, options)
+        if request.if_none_match.contains_weak(key):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            response = app.response_class(status=304)
+            response.set_etag(key)
+            return response
         
-        processed, errors = images_to_word(image_paths, output_path, mode, metadata_list)
-        
-        if processed == 0:
-            return jsonify({'error': 'No se pudo procesar ninguna imagen'}), 400
+        output_path = result_store.get(key) if result_store is not None else None
+        if output_path is not None:
+            output_filename = f"documento_{key[:12]}{os.path.splitext(output_path)[1]}"
+            etag = key
+        else:
+            # Esperar turno: las conversiones simultáneas están limitadas
+            with timer.stage('queue'):
+                g.admission.acquire(app.config['CONVERT_QUEUE_TIMEOUT'])
+            try:
+                output_path, output_filename, processed, errors, mtime_dates = convert_saved_files(
+                    saved_files, temp_dir, options, timer, output_name=f"documento_{key[:12]}"
+                )
+            finally:
+                g.admission.finish()
+            
+            if processed == 0:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                return jsonify({'error': 'No se pudo procesar ninguna imagen'}), 400
+            
+            # Con imágenes que fallaron (p. ej. un error transitorio) el
+            # resultado podría cambiar, y con pies tomados de la fecha de
+            # modificación (la de recepción de la subida) cambia en cada
+            # petición: no se guarda ni se identifica por la clave
+            etag = key if not errors and not mtime_dates else False
+            if etag and result_store is not None:
+                output_path = result_store.put(key, output_path)
         
         # Enviar archivo
         response = send_file(
             output_path,
             as_attachment=True,
             download_name=output_filename,
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            mimetype=output_mimetype(output_filename),
+            etag=etag
         )
+        response.headers['Server-Timing'] = timer.server_timing()
+        send_start = time.perf_counter()
         
-        # Limpiar después de enviar (usando callback)
-        @response.call_on_close
+        # Limpiar después de enviar. send_file entrega el archivo directo al
+        # servidor (direct_passthrough) y response.close() no se llama, así
+        # que call_on_close nunca corría: se envuelve el cuerpo de la respuesta
         def cleanup():
+            METRICS.observe('stage_seconds', time.perf_counter() - send_start, stage='send')
             try:
                 shutil.rmtree(temp_dir, ignore_errors=True)
             except:
                 pass
         
+        response.response = ClosingIterator(response.response, cleanup)
         return response
         
+    except Overloaded as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return overloaded_response(e)
     except Exception as e:
         # Limpiar en caso de error
         shutil.rmtree(temp_dir, ignore_errors=True)
         return jsonify({'error': f'Error al procesar: {str(e)}'}), 500
 
+def run_conversion_job(job, ticket, saved_files, options):
+    """
+    Conversión de un trabajo de /jobs (se ejecuta en el pool de trabajos).
+    ticket: lugar reservado por POST /jobs; espera turno sin límite de tiempo
+    """
+    timer = StageTimer()
+    try:
+        with timer.stage('queue'):
+            ticket.acquire()
+        output_path, output_filename, processed, errors, _ = convert_saved_files(
+            saved_files, job.temp_dir, options, timer, job.update
+        )
+    finally:
+        # Cede el turno y el lugar en la cola
+        ticket.release()
+    job.timings = timer.report()
+    if processed == 0:
+        raise ValueError('No se pudo procesar ninguna imagen')
+    job.output_path = output_path
+    job.output_filename = output_filename
+
+@app.route('/jobs', methods=['POST'])
+@admitted
+def create_job():
+    """Igual que /convert, pero responde enseguida con el id del trabajo"""
+    files, blob_refs, options, error = read_convert_options()
+    if error:
+        return error
+    
+    # El directorio vive hasta que vence el TTL del trabajo (ver jobs.JobStore)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        upload_start = time.perf_counter()
+        saved_files = save_uploads(files, temp_dir, blob_refs)
+        METRICS.observe('stage_seconds', time.perf_counter() - upload_start, stage='upload')
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({'error': f'Error al guardar las imágenes: {str(e)}'}), 500
+    
+    if not saved_files:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({'error': 'No se encontraron imágenes válidas'}), 400
+    
+    # El lugar en la cola pasa al trabajo, que lo libera al terminar
+    job = jobs.submit(temp_dir, len(saved_files), run_conversion_job, g.pop('admission'), saved_files, options)
+    response = jsonify({
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id),
+    })
+    response.headers['Location'] = url_for('job_status', job_id=job.id)
+    return response, 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Progreso del trabajo: estado, etapa, imágenes procesadas/total y errores"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o vencido'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Descarga el .docx (o .zip de volúmenes) terminado; admite Range para reanudar la descarga"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o vencido'}), 404
+    if job.status == FAILED:
+        return jsonify({'error': f'Error al procesar: {job.error}', 'errors': job.errors}), 400
+    if job.status != DONE:
+        return jsonify({'error': 'El documento todavía no está listo', **job.to_dict()}), 409
+    
+    return send_file(
+        job.output_path,
+        as_attachment=True,
+        download_name=job.output_filename,
+        mimetype=output_mimetype(job.output_filename),
+        conditional=True
+    )
+
 @app.route('/analyze_metadata', methods=['POST'])
+@admitted
 def analyze_metadata():
     """Analiza metadata de las imágenes sin convertirlas"""
-    if 'images' not in request.files:
-        return jsonify({'error': 'No se encontraron imágenes'}), 400
-    
-    files = request.files.getlist('images')
-    
-    if not files or all(f.filename == '' for f in files):
-        return jsonify({'error': 'No se seleccionaron archivos'}), 400
+    files, blob_refs, error = read_uploads()
+    if error:
+        return error
     
     temp_dir = tempfile.mkdtemp()
     
     try:
-        saved_files = []
-        for file in files:
-            if file and file.filename and allowed_file(file.filename):
-                filename = file.filename
-                filepath = os.path.join(temp_dir, filename)
-                file.save(filepath)
-                saved_files.append((filename, filepath))
+        saved_files = save_uploads(files, temp_dir, blob_refs)
         
         if not saved_files:
             return jsonify({'error': 'No se encontraron imágenes válidas'}), 400
         
         # Extraer metadata de todas las imágenes
         metadata_results = []
-        for filename, filepath in saved_files:
-            metadata = extract_image_metadata(filepath)
+        with g.admission.slot(app.config['CONVERT_QUEUE_TIMEOUT']):
+            records = build_image_records(saved_files, workers=app.config['IMAGE_WORKERS'], cache=image_cache)
+        if image_cache is not None:
+            image_cache.evict()
+        for record in records:
+            metadata = record['metadata'] or {'sender': None, 'datetime': None, 'file_mtime': None}
             metadata_results.append({
-                'filename': filename,
+                'filename': record['filename'],
                 'sender': metadata['sender'] or 'Desconocido',
                 'datetime': metadata['datetime'].strftime('%Y-%m-%d %H:%M:%S') if metadata['datetime'] else 'No disponible',
                 'file_mtime': metadata['file_mtime'].strftime('%Y-%m-%d %H:%M:%S') if metadata['file_mtime'] else 'No disponible'
@@ -413,10 +560,68 @@ def analyze_metadata():
             'metadata': metadata_results
         })
         
+    except Overloaded as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return overloaded_response(e)
     except Exception as e:
         shutil.rmtree(temp_dir, ignore_errors=True)
         return jsonify({'error': f'Error al analizar: {str(e)}'}), 500
 
+@app.route('/uploads/check', methods=['POST'])
+def check_uploads():
+    """Recibe {"hashes": [...]} y responde cuáles faltan subir y desde qué byte seguir"""
+    digests = (request.get_json(silent=True) or {}).get('hashes')
+    if not isinstance(digests, list) or not all(is_digest(d) for d in digests):
+        return jsonify({'error': 'Lista de hashes no válida'}), 400
+    return jsonify(upload_store.check(digests))
+
+@app.route('/uploads/<digest>', methods=['GET'])
+def upload_status(digest):
+    """Bytes recibidos de una imagen, para retomar una subida interrumpida"""
+    if not is_digest(digest):
+        return jsonify({'error': 'Hash no válido'}), 400
+    return jsonify({'received': upload_store.received(digest), 'complete': upload_store.has(digest)})
+
+@app.route('/uploads/<digest>', methods=['PUT'])
+def upload_chunk(digest):
+    """
+    Recibe una parte de la imagen con ese SHA1. La cabecera
+    Content-Range: bytes inicio-fin/total indica su posición; sin ella el
+    cuerpo es la imagen completa.
+    """
+    if not is_digest(digest):
+        return jsonify({'error': 'Hash no válido'}), 400
+    
+    data = request.get_data(cache=False)
+    content_range = request.headers.get('Content-Range')
+    if content_range:
+        match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', content_range.strip())
+        if not match or int(match.group(2)) - int(match.group(1)) + 1 != len(data):
+            return jsonify({'error': f'Content-Range no válido: {content_range}'}), 400
+        offset, total = int(match.group(1)), int(match.group(3))
+    else:
+        offset, total = 0, len(data)
+    
+    try:
+        received = upload_store.write_chunk(digest, offset, data, total)
+    except UploadOffsetError as e:
+        return jsonify({'error': str(e), 'received': e.received}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e), 'received': upload_store.received(digest)}), 400
+    return jsonify({'received': received, 'complete': received == total})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """Aciertos/fallos y ocupación del caché de imágenes"""
+    if image_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **image_cache.stats()})
+
 if __name__ == '__main__':
     # Crear carpeta templates si no existe
     os.makedirs('templates', exist_ok=True)
@@ -0,0 +1,463 @@
+"""
+Benchmarks del armado del documento Word.
+
+Uso:
+    python benchmark.py build                 # tiempo de armado: 50 / 500 / 2000 imágenes
+    python benchmark.py build 100 1000        # cantidades personalizadas
+    python benchmark.py memory                # memoria pico con 1000 imágenes
+    python benchmark.py memory --count 300 --quality screen
+    python benchmark.py corpus carpeta --count 500   # genera un corpus realista
+    python benchmark.py suite --json actual.json     # todas las etapas, en JSON
+    python benchmark.py compare base.json actual.json
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import app as app_module
+from app import app
+from converter import images_to_word, sort_images_by_metadata
+from image_metadata import extract_image_metadata
+from layout import DEFAULT_GRID
+from pipeline import StageTimer
+from sort_order import natural_key
+
+DEFAULT_COUNTS = (50, 500, 2000)
+
+# Casos (modo, grilla) en que benchmark_build compara el armado compilado con
+# el de referencia, con y sin streaming
+EQUIVALENCE_CASES = (('standard', DEFAULT_GRID), ('receipts', '3x4'))
+
+
+def create_small_images(folder, count):
+    """Crea imágenes JPEG pequeñas y distintas, para medir solo el armado del documento"""
+    paths = []
+    for i in range(count):
+        size = (64, 48) if i % 2 else (48, 64)
+        img = Image.new('RGB', size, color=(i % 256, (i * 7) % 256, (i * 13) % 256))
+        path = os.path.join(folder, f"IMG-20240101-WA{i:05d}.jpg")
+        img.save(path, quality=80)
+        paths.append(path)
+    return paths
+
+
+def create_photo_images(folder, count, size=(1024, 768)):
+    """Crea fotos sintéticas con ruido (no se comprimen bien, como una foto real)"""
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    paths = []
+    for i in range(count):
+        tint = Image.new('RGB', size, color=(i % 256, (i // 256) * 60 % 256, (i * 13) % 256))
+        img = Image.blend(noise, tint, 0.5)
+        if i % 2:
+            img = img.transpose(Image.ROTATE_90)
+        path = os.path.join(folder, f"IMG-20240101-WA{i:05d}.jpg")
+        img.save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+# Resoluciones típicas: fotos de celular, capturas de pantalla y fotos reenviadas por WhatsApp
+CORPUS_RESOLUTIONS = [(4032, 3024), (3264, 2448), (1600, 1200), (1280, 960), (1170, 2532), (1080, 1920), (800, 600)]
+
+# Formato de cada archivo del corpus: (extensión, formato de Pillow, peso relativo)
+CORPUS_FORMATS = [('jpg', 'JPEG', 70), ('png', 'PNG', 12), ('webp', 'WEBP', 8), ('gif', 'GIF', 5), ('tiff', 'TIFF', 5)]
+
+
+def create_corpus(folder, count, seed=0, scale=1.0):
+    """
+    Crea un corpus parecido a una exportación real de WhatsApp/cámara, siempre
+    igual para la misma semilla: resoluciones mezcladas, fotos verticales y
+    horizontales, nombres IMG-YYYYMMDD-WA#### y de cámara, EXIF con y sin fecha
+    (y con orientación), y JPEG/PNG/WebP/GIF/TIFF.
+    scale: factor aplicado a las resoluciones (p. ej. 0.25 para un corpus rápido)
+    Retorna la lista de rutas creadas.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    noise_cache = {}
+    start_date = datetime(2024, 1, 1, 8, 0, 0)
+    extensions = [fmt for fmt in CORPUS_FORMATS for _ in range(fmt[2])]
+    paths = []
+
+    for i in range(count):
+        width, height = rng.choice(CORPUS_RESOLUTIONS)
+        if width < height and rng.random() < 0.5 or width > height and rng.random() < 0.3:
+            width, height = height, width
+        size = (max(16, int(width * scale)), max(16, int(height * scale)))
+
+        # Ruido + formas: se comprime como una foto, no como un color plano
+        if size not in noise_cache:
+            noise_cache[size] = Image.effect_noise(size, 30).convert('RGB')
+        img = Image.blend(noise_cache[size], Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3))), 0.6)
+        draw = ImageDraw.Draw(img)
+        for _ in range(3):
+            x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.rectangle([x0, y0, x0 + size[0] // 4, y0 + size[1] // 6], fill=tuple(rng.randrange(256) for _ in range(3)))
+
+        taken = start_date + timedelta(minutes=rng.randrange(60 * 24 * 90))
+        extension, image_format, _ = rng.choice(extensions)
+        kind = rng.random()
+        if kind < 0.5:
+            name = f"IMG-{taken:%Y%m%d}-WA{i:04d}.{extension}"
+        elif kind < 0.8:
+            name = f"IMG_{taken:%Y%m%d_%H%M%S}_{i}.{extension}"
+        else:
+            name = f"Screenshot {i}.{extension}"
+
+        exif = Image.Exif()
+        if image_format in ('JPEG', 'PNG', 'WEBP', 'TIFF') and rng.random() < 0.5:
+            exif[0x0132] = taken.strftime('%Y:%m:%d %H:%M:%S')
+            exif.get_ifd(0x8769)[0x9003] = taken.strftime('%Y:%m:%d %H:%M:%S')
+            if rng.random() < 0.3:
+                exif[0x0112] = rng.choice((3, 6, 8))
+
+        path = os.path.join(folder, name)
+        if image_format == 'JPEG':
+            img.save(path, image_format, quality=rng.choice((70, 85, 92)), exif=exif)
+        elif image_format == 'GIF':
+            img.convert('P', palette=Image.ADAPTIVE).save(path, image_format)
+        elif image_format == 'PNG' and rng.random() < 0.3:
+            img.convert('RGBA').save(path, image_format, exif=exif)
+        else:
+            img.save(path, image_format, exif=exif)
+        paths.append(path)
+    return paths
+
+
+def benchmark_build(counts=DEFAULT_COUNTS):
+    """
+    Mide el tiempo de armado (etapa 'embed') en modo estándar con fecha
+    encima de cada imagen. Con un armado lineal, el tiempo por imagen se
+    mantiene constante al crecer la cantidad de imágenes.
+    También arma cada documento con las llamadas de python-docx de referencia
+    (compiled=False) y verifica que el .docx sea idéntico byte a byte; al
+    final repite esa verificación en cada caso de EQUIVALENCE_CASES, con y
+    sin streaming.
+    Retorna la lista de casos en que los documentos no son idénticos
+    """
+    mismatches = []
+    temp_dir = tempfile.mkdtemp()
+    try:
+        paths = create_small_images(temp_dir, max(counts))
+        start_date = datetime(2024, 1, 1)
+        print(f"{'imágenes':>9} {'embed (s)':>10} {'total (s)':>10} {'µs/imagen':>10} {'referencia (s)':>15} "
+              f"{'idéntico':>9}")
+
+        for count in counts:
+            subset = paths[:count]
+            metadata = [
+                {'filepath': path, 'datetime': start_date + timedelta(minutes=i)}
+                for i, path in enumerate(subset)
+            ]
+            output = os.path.join(temp_dir, f"bench_{count}.docx")
+            timer = StageTimer()
+
+            start = time.perf_counter()
+            images_to_word(subset, output, 'standard', metadata, quality='original',
+                           workers=1, timer=timer)
+            total = time.perf_counter() - start
+
+            reference_output = os.path.join(temp_dir, f"bench_{count}_reference.docx")
+            reference_timer = StageTimer()
+            images_to_word(subset, reference_output, 'standard', metadata, quality='original',
+                           workers=1, timer=reference_timer, compiled=False)
+            with open(output, 'rb') as f, open(reference_output, 'rb') as g:
+                identical = f.read() == g.read()
+            if not identical:
+                mismatches.append(f"standard {count} imágenes")
+
+            embed = timer.totals.get('embed', 0.0)
+            reference_embed = reference_timer.totals.get('embed', 0.0)
+            print(f"{count:>9} {embed:>10.3f} {total:>10.3f} {embed / count * 1e6:>10.1f} {reference_embed:>15.3f} "
+                  f"{'sí' if identical else 'NO':>9}")
+
+        count = min(counts)
+        subset = paths[:count]
+        metadata = [
+            {'filepath': path, 'datetime': start_date + timedelta(minutes=i)}
+            for i, path in enumerate(subset)
+        ]
+        print(f"\nCompilado vs. referencia ({count} imágenes)")
+        print(f"{'modo':>9} {'grilla':>7} {'streaming':>10} {'idéntico':>9}")
+        for mode, grid in EQUIVALENCE_CASES:
+            for streaming in (False, True):
+                outputs = []
+                for compiled in (True, False):
+                    output = os.path.join(temp_dir, f"equiv_{mode}_{grid}_{streaming}_{compiled}.docx")
+                    images_to_word(subset, output, mode, metadata, quality='original', workers=1,
+                                   streaming=streaming, grid=grid, compiled=compiled)
+                    with open(output, 'rb') as f:
+                        outputs.append(f.read())
+                identical = outputs[0] == outputs[1]
+                if not identical:
+                    mismatches.append(f"{mode} {grid}{' con streaming' if streaming else ''}")
+                print(f"{mode:>9} {grid:>7} {'sí' if streaming else 'no':>10} {'sí' if identical else 'NO':>9}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return mismatches
+
+
+def _measure_conversion(paths, output, mode, quality, streaming):
+    """Se ejecuta en un proceso nuevo: retorna (pico tracemalloc, pico RSS, segundos)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    images_to_word(paths, output, mode, quality=quality, workers=1, streaming=streaming)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    maxrss = 0
+    if resource is not None:
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if os.uname().sysname != 'Darwin':
+            maxrss *= 1024
+    return peak, maxrss, elapsed
+
+
+def benchmark_memory(count=1000, quality='original'):
+    """
+    Compara la memoria pico del armado en memoria contra el modo streaming,
+    en ambos modos de organización. Cada medición corre en un proceso nuevo.
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print(f"Generando {count} imágenes sintéticas...")
+        paths = create_photo_images(temp_dir, count)
+        input_bytes = sum(os.path.getsize(path) for path in paths)
+        print(f"Entrada: {input_bytes / 2**20:.1f} MB · calidad: {quality}")
+        print(f"{'modo':>9} {'streaming':>10} {'tracemalloc':>12} {'RSS':>9} {'salida':>9} {'tiempo':>8}")
+
+        context = multiprocessing.get_context('spawn')
+        for mode in ('standard', 'receipts'):
+            for streaming in (False, True):
+                output = os.path.join(temp_dir, f"bench_{mode}_{streaming}.docx")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    peak, maxrss, elapsed = executor.submit(
+                        _measure_conversion, paths, output, mode, quality, streaming
+                    ).result()
+                print(f"{mode:>9} {str(streaming):>10} {peak / 2**20:>10.1f}MB {maxrss / 2**20:>7.1f}MB "
+                      f"{os.path.getsize(output) / 2**20:>7.1f}MB {elapsed:>7.1f}s")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _rss_bytes():
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+def _run_case(func):
+    """Ejecuta func midiendo tiempo y memoria pico (tracemalloc). Retorna (resultado, segundos, pico)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _suite_case(name, paths, func, output=None):
+    _, elapsed, peak = _run_case(func)
+    count = len(paths)
+    case = {
+        'name': name,
+        'images': count,
+        'seconds': round(elapsed, 4),
+        'images_per_sec': round(count / elapsed, 2) if elapsed else None,
+        'peak_memory_bytes': peak,
+    }
+    if output is not None:
+        size = os.path.getsize(output)
+        case['output_bytes'] = size
+        case['output_bytes_per_image'] = round(size / count)
+    print(f"{name:<34} {case['images_per_sec'] or 0:>9.1f} img/s {peak / 2**20:>8.1f}MB"
+          + (f" {case['output_bytes_per_image'] / 1024:>8.1f}KB/img" if output else ''))
+    return case
+
+
+def benchmark_suite(count=200, quality='print', workers=1, scale=0.5, corpus=None, seed=0, use_cache=False):
+    """
+    Mide cada etapa sobre un corpus realista: extract_image_metadata,
+    sort_images_by_metadata, images_to_word (standard y receipts, con y sin
+    orden por metadata) y el endpoint /convert vía el cliente de pruebas de Flask.
+    workers=1 deja todo el trabajo en este proceso, para que tracemalloc lo vea.
+    use_cache: dejar activos el caché de imágenes y el almacén de resultados de
+        la app en /convert (por defecto se desactivan: el corpus generado es
+        siempre el mismo y las mediciones entre versiones quedarían como
+        aciertos del caché, o directamente como documentos ya generados)
+    Retorna un diccionario serializable a JSON.
+    """
+    temp_dir = tempfile.mkdtemp()
+    app_cache = app_module.image_cache
+    app_results = app_module.result_store
+    if not use_cache:
+        app_module.image_cache = None
+        app_module.result_store = None
+    try:
+        if corpus:
+            paths = sorted(p for p in glob.glob(os.path.join(corpus, '*')) if os.path.isfile(p))[:count]
+        else:
+            print(f"Generando corpus de {count} imágenes (escala {scale})...")
+            paths = create_corpus(os.path.join(temp_dir, 'corpus'), count, seed, scale)
+        file_list = [(os.path.basename(p), p) for p in paths]
+        input_bytes = sum(os.path.getsize(p) for p in paths)
+        print(f"Entrada: {len(paths)} imágenes, {input_bytes / 2**20:.1f} MB · calidad: {quality} · procesos: {workers}")
+
+        cases = [
+            _suite_case('extract_image_metadata', paths, lambda: [extract_image_metadata(p) for p in paths]),
+            _suite_case('sort_images_by_metadata', paths, lambda: sort_images_by_metadata(list(file_list), workers)),
+        ]
+        for mode in ('standard', 'receipts'):
+            for sort_by in ('name', 'metadata'):
+                output = os.path.join(temp_dir, f"{mode}_{sort_by}.docx")
+
+                def convert(mode=mode, sort_by=sort_by, output=output):
+                    metadata = None
+                    # El mismo orden natural que convert_images
+                    ordered = sorted(paths, key=lambda p: natural_key(os.path.basename(p)))
+                    if sort_by == 'metadata':
+                        ordered, metadata = sort_images_by_metadata(list(file_list), workers)
+                    images_to_word(ordered, output, mode, metadata, quality, workers,
+                                   streaming=app.config['STREAMING_DOCX'])
+
+                cases.append(_suite_case(f"images_to_word[{mode},{sort_by}]", paths, convert, output))
+
+        endpoint_output = os.path.join(temp_dir, 'endpoint.docx')
+
+        def post_convert():
+            app.config['IMAGE_WORKERS'] = workers
+            client = app.test_client()
+            handles = [open(p, 'rb') for p in paths]
+            try:
+                data = {'images': [(h, os.path.basename(p)) for h, p in zip(handles, paths)],
+                        'mode': 'standard', 'sort_by': 'metadata', 'quality': quality}
+                response = client.post('/convert', data=data, content_type='multipart/form-data')
+                if response.status_code != 200:
+                    raise RuntimeError(f"/convert respondió {response.status_code}: {response.get_data(as_text=True)}")
+                with open(endpoint_output, 'wb') as f:
+                    f.write(response.get_data())
+                response.close()
+            finally:
+                for h in handles:
+                    h.close()
+
+        cases.append(_suite_case('POST /convert', paths, post_convert, endpoint_output))
+
+        return {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'images': len(paths),
+            'input_bytes': input_bytes,
+            'quality': quality,
+            'workers': workers,
+            'scale': scale,
+            'seed': seed,
+            'image_cache': use_cache,
+            'result_store': use_cache and app_results is not None,
+            'peak_rss_bytes': _rss_bytes(),
+            'cases': cases,
+        }
+    finally:
+        app_module.image_cache = app_cache
+        app_module.result_store = app_results
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def compare_results(base_file, current_file):
+    """Muestra la variación de cada caso entre dos resultados JSON de la suite"""
+    with open(base_file) as f:
+        base = {case['name']: case for case in json.load(f)['cases']}
+    with open(current_file) as f:
+        current = json.load(f)['cases']
+
+    def delta(old, new):
+        if not old or new is None:
+            return '      -'
+        return f"{(new - old) / old * 100:>+6.1f}%"
+
+    print(f"{'caso':<34} {'img/s':>9} {'Δ':>7} {'memoria':>9} {'Δ':>7} {'KB/img':>8} {'Δ':>7}")
+    for case in current:
+        old = base.get(case['name'], {})
+        per_image = case.get('output_bytes_per_image')
+        print(f"{case['name']:<34} {case['images_per_sec'] or 0:>9.1f} "
+              f"{delta(old.get('images_per_sec'), case['images_per_sec'])} "
+              f"{case['peak_memory_bytes'] / 2**20:>7.1f}MB "
+              f"{delta(old.get('peak_memory_bytes'), case['peak_memory_bytes'])} "
+              f"{(per_image or 0) / 1024:>8.1f} {delta(old.get('output_bytes_per_image'), per_image)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de Imágenes a Word")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    build_parser = subparsers.add_parser("build", help="tiempo de armado según cantidad de imágenes")
+    build_parser.add_argument("counts", nargs="*", type=int, default=list(DEFAULT_COUNTS))
+
+    memory_parser = subparsers.add_parser("memory", help="memoria pico con y sin streaming")
+    memory_parser.add_argument("--count", type=int, default=1000)
+    memory_parser.add_argument("--quality", default="original")
+
+    corpus_parser = subparsers.add_parser("corpus", help="genera un corpus realista de imágenes")
+    corpus_parser.add_argument("folder")
+    corpus_parser.add_argument("--count", type=int, default=200)
+    corpus_parser.add_argument("--seed", type=int, default=0)
+    corpus_parser.add_argument("--scale", type=float, default=1.0, help="factor de resolución")
+
+    suite_parser = subparsers.add_parser("suite", help="todas las etapas sobre un corpus, con salida JSON")
+    suite_parser.add_argument("--count", type=int, default=200)
+    suite_parser.add_argument("--quality", default="print")
+    suite_parser.add_argument("--workers", type=int, default=1)
+    suite_parser.add_argument("--scale", type=float, default=0.5, help="factor de resolución del corpus generado")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--corpus", help="usar las imágenes de esta carpeta en lugar de generarlas")
+    suite_parser.add_argument("--json", help="archivo donde guardar los resultados")
+    suite_parser.add_argument("--cache", action="store_true", help="usar el caché de imágenes y el almacén de resultados en /convert")
+
+    compare_parser = subparsers.add_parser("compare", help="compara dos resultados JSON de la suite")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("current")
+
+    args = parser.parse_args()
+    if args.benchmark == "build":
+        # El armado compilado tiene que dar el mismo .docx que el de referencia
+        mismatches = benchmark_build(args.counts)
+        if mismatches:
+            sys.exit(f"Compilado distinto de la referencia: {', '.join(mismatches)}")
+    elif args.benchmark == "memory":
+        benchmark_memory(args.count, args.quality)
+    elif args.benchmark == "corpus":
+        paths = create_corpus(args.folder, args.count, args.seed, args.scale)
+        print(f"{len(paths)} imágenes creadas en {args.folder}")
+    elif args.benchmark == "suite":
+        results = benchmark_suite(args.count, args.quality, args.workers, args.scale, args.corpus, args.seed,
+                                  args.cache)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Resultados guardados en {args.json}")
+        else:
+            print(json.dumps(results, indent=2))
+    else:
+        compare_results(args.base, args.current)
@@ -0,0 +1,729 @@
+"""
+Motor de conversión de imágenes a Word, compartido por la aplicación web
+(app.py) y la CLI (images_to_word.py).
+
+- build_image_records: registros de imagen en paralelo (pipeline.py)
+- sort_images_by_metadata: orden por fecha/hora de envío
+- images_to_word: arma el documento en el modo indicado
+- images_to_volumes: igual, repartido en documentos con límites de páginas,
+  imágenes o bytes
+- convert_images: ordena y arma el documento (el camino completo de /convert),
+  o agrega las imágenes nuevas a un documento ya generado
+
+Cada documento lleva un manifiesto de sus imágenes (docx_manifest.py).
+"""
+from docx import Document
+from docx.shared import Pt, RGBColor
+from docx.enum.table import WD_ROW_HEIGHT_RULE, WD_CELL_VERTICAL_ALIGNMENT
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK, WD_LINE_SPACING
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+import os
+import io
+import time
+from functools import partial
+from operator import attrgetter
+
+from image_cache import file_digest
+from image_prep import DEFAULT_PROFILE, get_profile
+from image_source import source_file, source_name
+from docx_manifest import check_manifest_options, new_manifest, read_manifest, write_manifest
+from docx_templates import Fragment, fill_picture, new_picture_inline
+from docx_writer import DocumentWriter, StreamingDocumentWriter
+from layout import DEFAULT_GRID, GRID_SEPARATOR_HEIGHT, configure_section, get_grid, grid_cell_size
+from metrics import METRICS
+from pipeline import StageTimer, build_image_record, imap_ordered
+from sort_order import SortEntry, merge_sorted, metadata_entry, natural_key
+
+# Extensiones válidas de imagen
+VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
+
+# Pie con la fecha de cada imagen: encima en modo estándar, y en la celda con
+# un salto de línea antes de la imagen en modo recibos
+STANDARD_CAPTION_FORMAT = '📅 %d/%m/%Y  🕐 %H:%M:%S'
+GRID_CAPTION_FORMAT = '📅 %d/%m/%Y %H:%M\n'
+
+
+def allowed_file(filename):
+    return os.path.splitext(filename.lower())[1] in VALID_EXTENSIONS
+
+
+def build_image_records(file_list, mode=None, quality=DEFAULT_PROFILE, read_metadata=True, workers=None, timer=None,
+                        cache=None, grid=DEFAULT_GRID):
+    """
+    Abre cada imagen una sola vez (en paralelo) y construye su registro:
+    dimensiones, formato, metadata y, si se indica el modo, la imagen ya
+    preparada para ese modo (ver pipeline.build_image_record)
+    
+    Args:
+        file_list: Lista de tuplas (filename, filepath)
+        mode: Modo para el que se preparan las imágenes (None = solo metadata)
+        quality: Perfil de calidad de QUALITY_PROFILES
+        read_metadata: Extraer fecha/remitente; las imágenes preparadas
+            reservan espacio para la fecha, que se muestra al ordenar por metadata
+        workers: Procesos a usar (None = todos los núcleos, 1 = en serie)
+        timer: StageTimer opcional donde se acumulan los tiempos por etapa
+        cache: ImageCache opcional con imágenes ya preparadas y su metadata
+        grid: Cuadrícula del modo recibos (layout.RECEIPT_GRIDS)
+    Retorna: lista de registros en el mismo orden que file_list
+    """
+    return list(iter_image_records(file_list, mode, quality, read_metadata, workers, timer, cache, grid))
+
+
+def iter_image_records(file_list, mode=None, quality=DEFAULT_PROFILE, read_metadata=True, workers=None, timer=None,
+                       cache=None, grid=DEFAULT_GRID):
+    """Igual que build_image_records, pero entrega cada registro apenas está listo"""
+    build = partial(build_image_record, mode=mode, quality=quality, read_metadata=read_metadata, cache=cache,
+                    grid=grid)
+    items = [(filepath, read_metadata) for _, filepath in file_list]
+    
+    for (filename, _), record in zip(file_list, imap_ordered(build, items, workers)):
+        # Conservar el nombre original del archivo subido
+        record['filename'] = filename
+        if timer is not None:
+            timer.merge(record['timings'])
+        if cache is not None:
+            cache.count(record)
+        yield record
+
+
+def sort_images_by_metadata(file_list, workers=None, timer=None, cache=None):
+    """
+    Ordena imágenes solo por fecha/hora
+    file_list: lista de tuplas (filename, filepath), o registros ya construidos
+        con build_image_records (no se vuelven a abrir las imágenes; se
+        completan con 'sender' y 'datetime')
+    workers: procesos para extraer la metadata en paralelo (None = todos los núcleos)
+    timer: StageTimer opcional donde se acumulan los tiempos de las etapas
+        'metadata' y 'sort'
+    cache: ImageCache opcional con la metadata ya leída
+    Retorna: tupla (lista ordenada de filepath, lista de SortEntry en el mismo
+    orden). De cada imagen leída solo se conserva su SortEntry, así la memoria
+    no depende del tamaño de la metadata
+    """
+    if timer is None:
+        timer = StageTimer()
+    if file_list and isinstance(file_list[0], dict):
+        entries = []
+        for record in file_list:
+            entry = metadata_entry(record)
+            # El registro se completa con los datos de ordenamiento
+            record['sender'] = (record['metadata'] or {}).get('sender') or 'Unknown'
+            record['datetime'] = entry.datetime
+            entries.append(entry)
+    else:
+        entries = [metadata_entry(record)
+                   for record in iter_image_records(file_list, workers=workers, timer=timer, cache=cache)]
+    
+    # Ordenar por datetime (fecha/hora de envío); con la misma fecha, por
+    # nombre en orden natural (sort_order.date_key)
+    with timer.stage('sort'):
+        entries.sort(key=attrgetter('key'))
+    
+    return [entry.filepath for entry in entries], entries
+
+
+class DocumentBuilder:
+    """
+    Arma un documento imagen por imagen en el modo indicado.
+
+    images_to_word usa uno solo; con límites de volumen se guarda uno y se
+    empieza el siguiente sin cortar el flujo de imágenes ya preparadas.
+    """
+
+    def __init__(self, output_file, mode, grid, manifest, document=None, streaming=False, compiled=True):
+        """
+        manifest: Manifiesto del documento (docx_manifest.new_manifest); cada
+            imagen insertada se le agrega con su SHA1 y su clave de orden
+        document: Documento ya generado al que se agregan las imágenes, en
+            lugar de uno nuevo (manifest debe ser el suyo); se arma en memoria
+        compiled: Armar cada imagen copiando fragmentos XML compilados al
+            empezar (docx_templates.py); con False, con las llamadas de
+            python-docx de referencia. El .docx es el mismo
+        """
+        self.output_file = output_file
+        self.mode = mode
+        self.manifest = manifest
+        # Imágenes que ya tiene el documento: las nuevas siguen después
+        self.existing = len(manifest['images'])
+        self.appending = document is not None
+        if self.appending:
+            streaming = False
+        else:
+            document = Document()
+            # Crear ya la parte del manifiesto (StreamingDocumentWriter la escribe al final)
+            write_manifest(document, manifest)
+        self.document = document
+        self.processed = 0
+        # Bytes de las imágenes incrustadas (casi todo el tamaño del .docx)
+        self.picture_bytes = 0
+
+        # Configurar márgenes según el modo
+        available_width, available_height = configure_section(document.sections[0], mode)
+        if streaming:
+            self.writer = StreamingDocumentWriter(document, output_file)
+        else:
+            self.writer = DocumentWriter(document)
+
+        self.per_page = 1
+        if mode != 'standard':
+            # MODO RECIBOS: una tabla de columnas x filas por página. Una sola
+            # tabla para todo el lote se vuelve muy lenta de abrir en Word a
+            # partir de unos cientos de filas; tablas chicas de tamaño fijo no.
+            # Las dimensiones de celda se calculan una sola vez
+            self.cols, self.rows = get_grid(grid)
+            self.col_width, self.row_height = grid_cell_size(available_width, available_height, grid)
+            self.per_page = self.cols * self.rows
+            self.table = None
+            self.page_cells = []
+            self.grid_pages = 0
+            if self.appending and self.existing:
+                # Seguir llenando la tabla de la última página, con las filas
+                # vacías que se quitaron al guardar
+                tables = document.tables
+                self.table = tables[-1]
+                self.grid_pages = len(tables)
+                self._format_grid_rows([self.table.add_row() for _ in range(self.rows - len(self.table.rows))])
+                self.page_cells = [cell for row in self.table.rows for cell in row.cells]
+
+        self.templates = self._compile_templates() if compiled else None
+        if self.templates is not None and self.mode != 'standard':
+            # Con fragmentos las celdas de la página se llenan directo en el XML (w:tc)
+            self.page_cells = [cell._tc for cell in self.page_cells]
+
+    @property
+    def images(self):
+        """Imágenes en el documento, contando las que ya tenía"""
+        return self.existing + self.processed
+
+    def has_room(self, record, limits):
+        """
+        Indica si la imagen entra sin pasar los límites del volumen
+        (max_images, max_pages, max_bytes; None = sin límite). Un documento
+        vacío siempre tiene lugar para una imagen.
+        """
+        if not self.images or not limits:
+            return True
+        if limits.get('max_images') and self.images + 1 > limits['max_images']:
+            return False
+        if limits.get('max_pages') and -(-(self.images + 1) // self.per_page) > limits['max_pages']:
+            return False
+        if limits.get('max_bytes') and self.picture_bytes + (record['output_bytes'] or 0) > limits['max_bytes']:
+            return False
+        return True
+
+    def add(self, record, picture, img_datetime, sort_key):
+        """Inserta la imagen (ruta o stream) en la siguiente posición"""
+        # Posición de la imagen en el documento (después de las que ya tenía)
+        slot = self.images
+        if self.templates is not None:
+            self._add_compiled(slot, record, picture, img_datetime)
+        else:
+            self._add_reference(slot, record, picture, img_datetime)
+        
+        # Escribir y liberar lo ya terminado (solo en modo streaming)
+        self.writer.flush()
+        self.processed += 1
+        self.picture_bytes += record['output_bytes'] or 0
+        self.manifest['images'].append([record['digest'], sort_key])
+
+    def _add_reference(self, slot, record, picture, img_datetime):
+        # Armado con las llamadas de python-docx (la referencia de los fragmentos)
+        writer = self.writer
+        if self.mode == 'standard':
+            # Agregar salto de página antes (excepto en la primera imagen)
+            if slot > 0:
+                writer.add_page_break()
+            
+            # Agregar fecha/hora si hay metadata disponible
+            if img_datetime:
+                _add_standard_caption(writer.add_paragraph(), img_datetime.strftime(STANDARD_CAPTION_FORMAT))
+            
+            # Agregar la imagen en su propio párrafo centrado (se guarda la
+            # referencia: document.paragraphs[-1] recorre todo el documento)
+            picture_paragraph = writer.add_paragraph()
+            picture_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            writer.add_picture(
+                picture_paragraph.add_run(), picture, record['picture_width'], record['picture_height']
+            )
+
+        else:
+            # Celda dentro de la página (por filas)
+            if slot // self.per_page == self.grid_pages:
+                self._start_grid_page()
+            
+            paragraph = self.page_cells[slot % self.per_page].paragraphs[0]
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            
+            # Agregar fecha/hora si hay metadata disponible
+            if img_datetime:
+                _add_caption_run(paragraph, img_datetime.strftime(GRID_CAPTION_FORMAT), 8)
+            
+            writer.add_picture(
+                paragraph.add_run(), picture, record['picture_width'], record['picture_height']
+            )
+
+    def _add_compiled(self, slot, record, picture, img_datetime):
+        # Lo mismo que _add_reference, copiando los fragmentos y completando sus valores
+        writer = self.writer
+        templates = self.templates
+        picture_values = writer.embed_image(picture, record['picture_width'], record['picture_height'])
+        if self.mode == 'standard':
+            if slot > 0:
+                writer.add_block(templates['page_break'].render()[0])
+            if img_datetime:
+                paragraph, nodes = templates['caption'].render()
+                nodes['text'].text = img_datetime.strftime(STANDARD_CAPTION_FORMAT)
+                writer.add_block(paragraph)
+            paragraph, nodes = templates['picture'].render()
+            fill_picture(nodes, *picture_values)
+            writer.add_block(paragraph)
+        else:
+            if slot // self.per_page == self.grid_pages:
+                self._start_grid_page()
+            paragraph, nodes = templates['captioned_cell' if img_datetime else 'cell'].render()
+            if img_datetime:
+                # El salto de línea final del pie es un w:br propio del fragmento
+                nodes['text'].text = img_datetime.strftime(GRID_CAPTION_FORMAT).rstrip('\n')
+            fill_picture(nodes, *picture_values)
+            tc = self.page_cells[slot % self.per_page]
+            tc.replace(tc.find(qn('w:p')), paragraph)
+
+    def _compile_templates(self):
+        """
+        Fragmentos de este documento (ver docx_templates.py), armados una vez
+        con las mismas llamadas que _add_reference y _start_grid_page
+        """
+        body = self.writer._body
+
+        def paragraph():
+            return Paragraph(OxmlElement('w:p'), body)
+
+        def picture_paragraph(caption_format=None):
+            # Párrafo centrado con la imagen (y el pie de recibos, si se indica)
+            p = paragraph()
+            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            nodes = {}
+            if caption_format is not None:
+                nodes['text'] = _add_caption_run(p, caption_format, 8)._r.find(qn('w:t'))
+            inline, picture_nodes = new_picture_inline()
+            p.add_run()._r.add_drawing(inline)
+            return Fragment(p._p, **nodes, **picture_nodes)
+
+        if self.mode == 'standard':
+            page_break = paragraph()
+            page_break.add_run().add_break(WD_BREAK.PAGE)
+            caption = paragraph()
+            text = _add_standard_caption(caption, STANDARD_CAPTION_FORMAT)._r.find(qn('w:t'))
+            return {
+                'page_break': Fragment(page_break._p),
+                'caption': Fragment(caption._p, text=text),
+                'picture': picture_paragraph(),
+            }
+
+        separator = paragraph()
+        _format_grid_separator(separator)
+        table = self.writer.new_table(self.rows, self.cols)
+        table.autofit = False
+        self._format_grid_rows(table.rows)
+        return {
+            'separator': Fragment(separator._p),
+            'page': Fragment(table._tbl),
+            'cell': picture_paragraph(),
+            'captioned_cell': picture_paragraph(GRID_CAPTION_FORMAT),
+        }
+
+    def save(self, timer):
+        """Termina el documento (filas vacías, orden, manifiesto) y lo guarda"""
+        if self.mode != 'standard' and self.table is not None:
+            # Quitar las filas vacías de la última página
+            used_rows = -(-(self.images % self.per_page or self.per_page) // self.cols)
+            for row in self.table.rows[used_rows:]:
+                self.table._tbl.remove(row._tr)
+
+        if self.appending and self.manifest['sort_by'] == 'metadata' and self.processed:
+            # Llevar las imágenes nuevas a su lugar cronológico, el mismo que
+            # tendrían al generar el documento de nuevo (fecha y nombre, ver
+            # sort_key en _build_documents). Solo se mueven elementos XML
+            # desde la primera posición que cambia
+            with timer.stage('reorder'):
+                images = self.manifest['images']
+                # Las que ya estaban y las nuevas ya vienen ordenadas: basta mezclarlas
+                existing = len(images) - self.processed
+                order = list(merge_sorted((range(existing), range(existing, len(images))),
+                                          key=lambda i: images[i][1]))
+                start = next((i for i, slot in enumerate(order) if slot != i), None)
+                if start is not None:
+                    if self.mode == 'standard':
+                        _reorder_pages(self.document, order, start)
+                    else:
+                        _reorder_cells(self.document, order, start)
+                    self.manifest['images'] = [images[i] for i in order]
+
+        write_manifest(self.document, self.manifest)
+        with timer.stage('save'):
+            self.writer.save(self.output_file)
+
+    def _format_grid_rows(self, grid_rows):
+        for row in grid_rows:
+            row.height = self.row_height
+            row.height_rule = WD_ROW_HEIGHT_RULE.EXACTLY
+            for cell in row.cells:
+                cell.vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
+                cell.width = self.col_width
+
+    def _start_grid_page(self):
+        # Tabla de la página con todas sus filas y celdas ya formateadas
+        if self.templates is not None:
+            if self.table is not None:
+                self.writer.add_block(self.templates['separator'].render()[0])
+            tbl, _ = self.templates['page'].render()
+            self.table = Table(self.writer.add_block(tbl), self.writer._body)
+            self.page_cells = list(tbl.iter(qn('w:tc')))
+            self.grid_pages += 1
+            return
+        if self.table is not None:
+            _format_grid_separator(self.writer.add_paragraph())
+        self.table = self.writer.add_table(rows=self.rows, cols=self.cols)
+        self.table.autofit = False
+        self._format_grid_rows(self.table.rows)
+        self.page_cells = [cell for row in self.table.rows for cell in row.cells]
+        self.grid_pages += 1
+
+
+def _add_caption_run(paragraph, text, size):
+    """Agrega el texto del pie (fecha y hora) en negrita y color"""
+    run = paragraph.add_run(text)
+    run.font.size = Pt(size)
+    run.font.bold = True
+    run.font.color.rgb = RGBColor(102, 126, 234)  # Color morado
+    return run
+
+
+def _add_standard_caption(paragraph, text):
+    """Párrafo con fecha y hora encima de la imagen (modo estándar)"""
+    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    run = _add_caption_run(paragraph, text, 11)
+    # Espacio pequeño entre fecha e imagen
+    paragraph.paragraph_format.space_after = Pt(6)
+    return run
+
+
+def _format_grid_separator(paragraph):
+    # Párrafo mínimo entre tablas (Word une tablas seguidas) que además pasa
+    # a la página siguiente
+    separator_format = paragraph.paragraph_format
+    separator_format.page_break_before = True
+    separator_format.space_before = 0
+    separator_format.space_after = 0
+    separator_format.line_spacing = GRID_SEPARATOR_HEIGHT
+    separator_format.line_spacing_rule = WD_LINE_SPACING.EXACTLY
+
+
+def volume_path(output_file, number):
+    """Ruta del volumen number (desde 1): documento.docx -> documento_001.docx"""
+    base, ext = os.path.splitext(output_file)
+    return f"{base}_{number:03d}{ext}"
+
+
+def images_to_word(image_paths, output_file, mode='standard', images_metadata=None, quality=DEFAULT_PROFILE,
+                   workers=None, timer=None, streaming=False, progress=None, cache=None, grid=DEFAULT_GRID,
+                   manifest=None, document=None, compiled=True):
+    """
+    Convierte una lista de imágenes a un documento Word
+    
+    Args:
+        image_paths: Lista de rutas de archivos de imagen
+        output_file: Ruta del archivo de salida .docx
+        mode: 'standard' (1 por página) o 'receipts' (cuadrícula, ver grid)
+        images_metadata: Lista opcional con la fecha de cada imagen: los SortEntry
+            de sort_images_by_metadata, o diccionarios con 'filepath' y
+            'datetime'. Los registros de build_image_records ya preparados
+            para este modo y calidad se usan directamente, sin volver a abrir la imagen
+        quality: Perfil de calidad de QUALITY_PROFILES ('print', 'screen', 'original')
+        workers: Procesos para preparar imágenes en paralelo (None = todos los núcleos, 1 = en serie)
+        timer: StageTimer opcional donde se acumulan los tiempos por etapa
+        streaming: Escribir el .docx a medida que se arma, liberando cada imagen
+            apenas se guarda (memoria acotada a unas pocas imágenes)
+        progress: Función opcional progress(etapa, procesadas, total, errores),
+            llamada después de cada imagen y antes de guardar
+        cache: ImageCache opcional con imágenes ya preparadas
+        grid: Cuadrícula del modo recibos, columnas x filas por página
+            ('2x2', '2x3', '3x3', '3x4'); cada página es una tabla propia
+        manifest: Manifiesto del documento (docx_manifest.new_manifest)
+        document: Documento ya generado al que se agregan las imágenes, en
+            lugar de uno nuevo (manifest debe ser el suyo). Se arma en memoria
+            (sin streaming); ordenado por metadata, las imágenes nuevas quedan
+            en su lugar cronológico, si no al final
+        compiled: Armar con fragmentos XML precompilados (por defecto) o, con
+            False, con las llamadas de python-docx de referencia; el .docx
+            resultante es el mismo (ver DocumentBuilder)
+    Retorna: tupla (procesadas, errores)
+    """
+    _, processed, errors = _build_documents(image_paths, output_file, mode, images_metadata, quality, workers,
+                                            timer, streaming, progress, cache, grid, manifest, document,
+                                            compiled=compiled)
+    return processed, errors
+
+
+def images_to_volumes(image_paths, output_file, limits, mode='standard', images_metadata=None,
+                      quality=DEFAULT_PROFILE, workers=None, timer=None, streaming=False, progress=None, cache=None,
+                      grid=DEFAULT_GRID, compiled=True):
+    """
+    Igual que images_to_word, pero reparte las imágenes en varios documentos
+    (volúmenes) que no pasan los límites indicados. Cada volumen se arma y se
+    guarda por separado, en el mismo orden de image_paths.
+    
+    Args:
+        limits: {'max_images', 'max_pages', 'max_bytes'} (None o 0 = sin límite);
+            max_bytes cuenta los bytes de las imágenes incrustadas
+        (resto: ver images_to_word)
+    Retorna: tupla (rutas de los volúmenes, procesadas, errores). Si todo
+    entra en un solo volumen se guarda en output_file; si no, en
+    documento_001.docx, documento_002.docx...
+    """
+    return _build_documents(image_paths, output_file, mode, images_metadata, quality, workers, timer, streaming,
+                            progress, cache, grid, limits=limits, compiled=compiled)
+
+
+def _build_documents(image_paths, output_file, mode, images_metadata, quality, workers, timer, streaming, progress,
+                     cache, grid, manifest=None, document=None, limits=None, compiled=True):
+    get_profile(quality)  # Validar el perfil antes de empezar
+    get_grid(grid)
+    if timer is None:
+        timer = StageTimer()
+    if manifest is None:
+        manifest = new_manifest(mode, grid, quality, 'metadata' if images_metadata else 'name')
+    
+    # Crear mapas de filepath -> fecha del pie y filepath -> registro para búsqueda rápida
+    captions = {}
+    metadata_map = {}
+    if images_metadata:
+        for img_data in images_metadata:
+            if isinstance(img_data, SortEntry):
+                captions[img_data.filepath] = img_data.datetime
+            else:
+                metadata_map[img_data['filepath']] = img_data
+                captions[img_data['filepath']] = img_data.get('datetime')
+
+    def image_datetime(filepath):
+        return captions.get(filepath)
+
+    def is_prepared(filepath):
+        # Registro ya preparado para este modo/calidad/cuadrícula (o que ya falló al abrirse)
+        record = metadata_map.get(filepath)
+        return record is not None and (record.get('prepared_for') == (mode, quality, grid)
+                                       or bool(record.get('error')))
+
+    def prepared_records():
+        # Las imágenes que aún no tienen registro preparado se procesan en
+        # paralelo; todas llegan aquí en el orden de image_paths
+        pending = [(filepath, bool(image_datetime(filepath)))
+                   for filepath in image_paths if not is_prepared(filepath)]
+        build = partial(build_image_record, mode=mode, quality=quality, cache=cache, grid=grid)
+        fresh = imap_ordered(build, pending, workers)
+        for filepath in image_paths:
+            if is_prepared(filepath):
+                yield metadata_map[filepath]
+            else:
+                record = next(fresh)
+                timer.merge(record['timings'])
+                if cache is not None:
+                    cache.count(record)
+                yield record
+
+    def sort_key(filepath):
+        # Clave de orden del manifiesto: la misma que usa convert_images
+        # (sort_order.date_key), como lista, tal como vuelve del JSON
+        if manifest['sort_by'] == 'metadata':
+            value = image_datetime(filepath)
+            parts, name = natural_key(source_name(filepath))
+            return [value.isoformat() if value else '', list(parts), name]
+        return source_name(filepath)
+
+    processed = 0
+    errors = []
+    total = len(image_paths)
+    volumes = []
+
+    def report(stage, done):
+        if progress is not None:
+            progress(stage, done, total, errors)
+
+    def new_volume():
+        # Con límites cada volumen se escribe primero con su número
+        path = output_file if limits is None else volume_path(output_file, len(volumes) + 1)
+        volumes.append(path)
+        volume_manifest = manifest if len(volumes) == 1 else new_manifest(mode, grid, quality, manifest['sort_by'])
+        return DocumentBuilder(path, mode, grid, volume_manifest, document if len(volumes) == 1 else None,
+                               streaming, compiled)
+
+    builder = new_volume()
+    build_start = time.perf_counter()
+    report('build', 0)
+    for done, record in enumerate(prepared_records(), 1):
+        filepath = record['filepath']
+
+        if record['error']:
+            errors.append(f"{source_name(filepath)}: {record['error']}")
+            METRICS.record_failure(record['error_type'] or 'Error')
+            report('build', done)
+            continue
+
+        if not builder.has_room(record, limits):
+            # Volumen lleno: se guarda y las imágenes siguen en uno nuevo
+            report('save', done - 1)
+            builder.save(timer)
+            builder = new_volume()
+
+        picture = source_file(filepath) if record['picture'] is None else io.BytesIO(record['picture'])
+        # Liberar los bytes del registro; python-docx guarda su propia copia
+        record['picture'] = None
+        record['prepared_for'] = None
+
+        try:
+            embed_start = time.perf_counter()
+            with timer.stage('embed'):
+                builder.add(record, picture, image_datetime(filepath), sort_key(filepath))
+            processed += 1
+            METRICS.observe_image(record, time.perf_counter() - embed_start)
+            METRICS.inc('images_processed_total')
+        except Exception as e:
+            errors.append(f"{source_name(filepath)}: {str(e)}")
+            METRICS.record_failure(type(e).__name__)
+        report('build', done)
+    timer.add('build', time.perf_counter() - build_start)
+
+    report('save', total)
+    builder.save(timer)
+    if limits is not None and len(volumes) == 1:
+        # Todo entró en un volumen: conserva el nombre pedido
+        os.replace(volumes[0], output_file)
+        volumes = [output_file]
+    return volumes, processed, errors
+
+
+def _reorder_pages(document, order, start):
+    # Modo estándar: cada imagen es un grupo de párrafos (fecha e imagen)
+    # separado del siguiente por un párrafo con salto de página
+    body = document.element.body
+    sectPr = body.sectPr
+    groups = [[]]
+    page_breaks = []
+    for child in body.iterchildren():
+        if child is sectPr:
+            continue
+        if child.xpath('./w:r/w:br[@w:type="page"]') and not child.xpath('.//w:drawing'):
+            groups.append([])
+            page_breaks.append(child)
+            continue
+        groups[-1].append(child)
+
+    # Sacar todo desde la primera posición que cambia (con los saltos de
+    # página previos a cada grupo) y volver a agregarlo en orden
+    moved_breaks = page_breaks[max(start - 1, 0):]
+    for child in moved_breaks:
+        body.remove(child)
+    for group in groups[start:]:
+        for child in group:
+            body.remove(child)
+    moved_breaks = iter(moved_breaks)
+    for position in range(start, len(order)):
+        if position > 0:
+            sectPr.addprevious(next(moved_breaks))
+        for child in groups[order[position]]:
+            sectPr.addprevious(child)
+
+
+def _reorder_cells(document, order, start):
+    # Modo recibos: cada imagen es el contenido de una celda, por filas y
+    # tabla por tabla; las celdas quedan en su lugar y se mueve el contenido
+    cells = [tc for table in document.tables for tc in table._tbl.iter(qn('w:tc'))][:len(order)]
+    contents = [[child for child in tc if child.tag != qn('w:tcPr')] for tc in cells]
+    for position in range(start, len(cells)):
+        for child in contents[position]:
+            cells[position].remove(child)
+    for position in range(start, len(order)):
+        cells[position].extend(contents[order[position]])
+
+
+def convert_images(file_list, output_file, mode='standard', sort_by='name', quality=DEFAULT_PROFILE,
+                   grid=DEFAULT_GRID, workers=None, timer=None, streaming=False, progress=None, cache=None,
+                   append_to=None, limits=None):
+    """
+    Ordena las imágenes y arma el documento: el mismo camino para /convert,
+    /jobs y la CLI
+    
+    Args:
+        file_list: Lista de tuplas (filename, filepath); filepath puede ser una
+            image_source.MemoryImage (imagen subida que no se escribió a disco)
+        output_file: Ruta del archivo de salida .docx
+        sort_by: 'name' (nombre de archivo) o 'metadata' (fecha/hora de envío)
+        progress: Igual que en images_to_word; también recibe la etapa 'metadata'
+        mode, quality, grid, workers, timer, streaming, cache: ver images_to_word
+        append_to: Documento ya generado (con manifiesto) al que se agregan
+            solo las imágenes que no tiene, identificadas por SHA1; el
+            resultado se guarda en output_file, que puede ser el mismo archivo.
+            Si no hay imágenes nuevas no se escribe nada.
+            Lanza ValueError si el documento no tiene manifiesto o se generó
+            con otras opciones
+        limits: Límites por volumen (ver images_to_volumes); no se combina con append_to
+    Retorna: tupla (rutas de los documentos generados, procesadas, errores,
+    imágenes cuyo pie es la fecha de modificación del archivo). Esas fechas no
+    dependen del contenido (en las subidas son la fecha de recepción), así que
+    con alguna el documento no es reproducible
+    """
+    if timer is None:
+        timer = StageTimer()
+    if append_to is not None and limits:
+        raise ValueError('No se puede agregar imágenes a un documento dividido en volúmenes')
+    manifest = new_manifest(mode, grid, quality, sort_by)
+    document = None
+    if append_to is not None:
+        with timer.stage('append'):
+            document = Document(append_to)
+            manifest = read_manifest(document)
+        if manifest is None:
+            raise ValueError(f"{os.path.basename(append_to)} no tiene manifiesto de imágenes; "
+                             f"hay que generarlo de nuevo")
+        check_manifest_options(manifest, mode=mode, grid=grid, quality=quality, sort_by=sort_by)
+        # El documento existente se completa en memoria (ver images_to_word)
+        streaming = False
+        # Solo se preparan las imágenes que el documento todavía no tiene
+        with timer.stage('hash'):
+            digests = list(imap_ordered(file_digest, [filepath for _, filepath in file_list], workers))
+        included = {digest for digest, _ in manifest['images']}
+        file_list = [item for item, digest in zip(file_list, digests) if digest not in included]
+        if not file_list:
+            return [], 0, [], 0
+
+    metadata_list = None
+    entries = []
+    if sort_by == 'metadata':
+        if progress is not None:
+            progress('metadata', 0, len(file_list), [])
+        # Ordenar por metadata (fecha/hora). Sin streaming cada imagen se
+        # abre una sola vez para leer la metadata y prepararla; con streaming
+        # se prepara después, para no tener todas las imágenes en memoria, y
+        # de cada una solo se conserva su SortEntry
+        if streaming:
+            image_paths, entries = sort_images_by_metadata(file_list, workers, timer, cache)
+            metadata_list = entries
+        else:
+            metadata_list = build_image_records(file_list, mode, quality, True, workers, timer, cache, grid)
+            image_paths, entries = sort_images_by_metadata(metadata_list, timer=timer)
+    else:
+        # Ordenar por nombre de archivo, en orden natural (IMG-…-WA2 antes que IMG-…-WA10)
+        with timer.stage('sort'):
+            image_paths = [filepath for _, filepath in sorted(file_list, key=lambda x: natural_key(x[0]))]
+    
+    mtime_dates = sum(entry.from_mtime for entry in entries)
+    if limits:
+        volumes, processed, errors = images_to_volumes(image_paths, output_file, limits, mode, metadata_list,
+                                                       quality, workers, timer, streaming, progress, cache, grid)
+        return volumes, processed, errors, mtime_dates
+    processed, errors = images_to_word(image_paths, output_file, mode, metadata_list, quality,
+                                       workers, timer, streaming, progress, cache, grid, manifest, document)
+    return [output_file], processed, errors, mtime_dates
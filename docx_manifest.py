@@ -0,0 +1,112 @@
+"""
+Manifiesto de las imágenes de un documento generado, guardado en sus
+propiedades personalizadas (docProps/custom.xml).
+
+Permite agregar imágenes a un documento ya generado sin volver a incrustar
+las que tiene: el manifiesto guarda el SHA1 de cada imagen y su clave de orden,
+en el mismo orden en que aparecen en el documento, junto con las opciones con
+que se generó (modo, cuadrícula, calidad y orden).
+"""
+import base64
+import json
+import zlib
+
+from lxml import etree
+
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.part import Part
+
+# 2: con sort_by=metadata la clave de orden es [fecha ISO, partes de
+# natural_key, nombre]; en la versión 1 era solo la fecha
+MANIFEST_VERSION = 2
+
+# Prefijo de las propiedades del manifiesto. Word solo admite valores de texto
+# de hasta 255 caracteres, así que el manifiesto (JSON comprimido en base64)
+# se reparte en varias propiedades numeradas
+MANIFEST_PROPERTY = 'ImagenesAWord.manifest.'
+PROPERTY_CHUNK = 255
+
+# Opciones que deben coincidir para agregar imágenes a un documento
+MANIFEST_OPTIONS = ('mode', 'grid', 'quality', 'sort_by')
+
+_CUSTOM_PROPERTIES_URI = '/docProps/custom.xml'
+_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/custom-properties'
+_VT_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes'
+# Identificador de formato que Word usa para las propiedades personalizadas
+_FMTID = '{D5CDD505-2E9C-101B-9397-08002B2CF9AE}'
+
+
+def new_manifest(mode, grid, quality, sort_by):
+    """Manifiesto vacío para un documento generado con esas opciones"""
+    return {'version': MANIFEST_VERSION, 'mode': mode, 'grid': grid, 'quality': quality, 'sort_by': sort_by,
+            'images': []}
+
+
+def read_manifest(document):
+    """Retorna el manifiesto guardado en el documento, o None si no tiene"""
+    part = _custom_properties_part(document)
+    if part is None:
+        return None
+    chunks = {}
+    for prop in etree.fromstring(part.blob).iterfind(f'{{{_NS}}}property'):
+        name = prop.get('name', '')
+        if name.startswith(MANIFEST_PROPERTY):
+            chunks[name] = ''.join(prop.itertext())
+    if not chunks:
+        return None
+    try:
+        data = base64.b64decode(''.join(chunks[name] for name in sorted(chunks)))
+        manifest = json.loads(zlib.decompress(data))
+    except (ValueError, zlib.error):
+        return None
+    if manifest.get('version') == 1:
+        # Sin el nombre, las imágenes que ya tenía van primero entre las de la misma fecha
+        if manifest.get('sort_by') == 'metadata':
+            manifest['images'] = [[digest, [key, [], '']] for digest, key in manifest['images']]
+        manifest['version'] = MANIFEST_VERSION
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(document, manifest):
+    """
+    Guarda el manifiesto en las propiedades personalizadas del documento,
+    conservando las demás propiedades que tenga
+    """
+    part = _custom_properties_part(document)
+    if part is None:
+        root = etree.Element(f'{{{_NS}}}Properties', nsmap={None: _NS, 'vt': _VT_NS})
+        part = Part(PackURI(_CUSTOM_PROPERTIES_URI), CT.OFC_CUSTOM_PROPERTIES, package=document.part.package)
+        document.part.package.relate_to(part, RT.CUSTOM_PROPERTIES)
+    else:
+        root = etree.fromstring(part.blob)
+        for prop in root.findall(f'{{{_NS}}}property'):
+            if prop.get('name', '').startswith(MANIFEST_PROPERTY):
+                root.remove(prop)
+
+    encoded = base64.b64encode(zlib.compress(json.dumps(manifest, separators=(',', ':')).encode())).decode()
+    # Los pid empiezan en 2 y no se repiten dentro del documento
+    pid = max((int(prop.get('pid', 1)) for prop in root), default=1) + 1
+    for n, start in enumerate(range(0, len(encoded), PROPERTY_CHUNK)):
+        prop = etree.SubElement(root, f'{{{_NS}}}property', fmtid=_FMTID, pid=str(pid + n),
+                                name=f'{MANIFEST_PROPERTY}{n:04d}')
+        etree.SubElement(prop, f'{{{_VT_NS}}}lpwstr').text = encoded[start:start + PROPERTY_CHUNK]
+    part._blob = etree.tostring(root, encoding='UTF-8', xml_declaration=True, standalone=True)
+
+
+def check_manifest_options(manifest, **options):
+    """Lanza ValueError si el documento se generó con otras opciones"""
+    for name in MANIFEST_OPTIONS:
+        if manifest.get(name) != options[name]:
+            raise ValueError(f"El documento se generó con {name}={manifest.get(name)}, no {options[name]}; "
+                             f"hay que generarlo de nuevo")
+
+
+def _custom_properties_part(document):
+    try:
+        return document.part.package.part_related_by(RT.CUSTOM_PROPERTIES)
+    except KeyError:
+        return None
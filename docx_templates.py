@@ -0,0 +1,84 @@
+"""
+Fragmentos WordprocessingML precompilados.
+
+Armar cada imagen con los objetos de python-docx (add_paragraph, add_run,
+propiedades de fuente, alineación, add_picture...) recorre y modifica el
+árbol lxml en cada llamada, y en lotes grandes de recibos ese costo se acerca
+al de preparar las imágenes. Un Fragment se arma una sola vez con esas mismas
+llamadas, así el XML es idéntico al de python-docx, y después por cada imagen
+se copia entero (copia en C de lxml) y se completan solo sus valores: rId,
+tamaño en EMU, texto del pie.
+
+converter.DocumentBuilder compila sus fragmentos al empezar cada documento;
+con compiled=False usa las llamadas de python-docx de referencia, que dan el
+mismo .docx byte a byte (ver benchmark.py build).
+"""
+import copy
+
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+
+
+class Fragment:
+    """
+    Elemento XML ya armado con los nodos donde van los valores de cada uso.
+    nodes: nombre -> elemento dentro de element (o element mismo)
+    """
+
+    def __init__(self, element, **nodes):
+        self.element = element
+        # Cada nodo se ubica por su posición, que es la misma en cada copia
+        self._paths = {name: _index_path(element, node) for name, node in nodes.items()}
+
+    def render(self):
+        """Retorna una copia del fragmento y sus nodos: (elemento, {nombre: nodo})"""
+        element = copy.deepcopy(self.element)
+        nodes = {}
+        for name, path in self._paths.items():
+            node = element
+            for index in path:
+                node = node[index]
+            nodes[name] = node
+        return element, nodes
+
+
+def _index_path(root, node):
+    path = []
+    while node is not root:
+        parent = node.getparent()
+        if parent is None:
+            raise ValueError('El nodo no está dentro del fragmento')
+        path.append(parent.index(node))
+        node = parent
+    path.reverse()
+    return path
+
+
+def new_picture_inline():
+    """
+    wp:inline de una imagen, igual al de CT_Inline.new_pic_inline, y sus
+    nodos variables (para Fragment): ver fill_picture
+    """
+    inline = CT_Inline.new_pic_inline(1, 'rId1', 'image', 1, 1)
+    pic = inline.graphic.graphicData.pic
+    nodes = {
+        'extent': inline.extent,
+        'docPr': inline.docPr,
+        'cNvPr': pic.nvPicPr.cNvPr,
+        'blip': pic.blipFill.blip,
+        'ext': pic.spPr.xfrm.ext,
+    }
+    return inline, nodes
+
+
+def fill_picture(nodes, shape_id, rId, filename, cx, cy):
+    """Completa los nodos de new_picture_inline con los valores de DocumentWriter.embed_image"""
+    cx, cy = str(int(cx)), str(int(cy))
+    nodes['extent'].set('cx', cx)
+    nodes['extent'].set('cy', cy)
+    nodes['docPr'].set('id', str(shape_id))
+    nodes['docPr'].set('name', f"Picture {shape_id}")
+    nodes['cNvPr'].set('name', filename)
+    nodes['blip'].set(qn('r:embed'), rId)
+    nodes['ext'].set('cx', cx)
+    nodes['ext'].set('cy', cy)
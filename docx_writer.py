@@ -0,0 +1,312 @@
+"""
+Inserción de muchas imágenes en un documento python-docx con costo constante
+por imagen.
+
+Varias operaciones de python-docx recorren todo el documento en cada llamada,
+lo que hace que armar un documento sea O(n²) en la cantidad de imágenes:
+- StoryPart.next_id busca con XPath todos los atributos id del documento
+- Document.add_paragraph busca w:sectPr entre todos los hijos del body
+- Document.add_table busca todas las secciones del documento (XPath) para
+  calcular el ancho de la tabla
+- get_or_add_image recalcula el SHA1 de cada imagen ya incrustada para
+  detectar duplicados, y busca el siguiente nombre libre en word/media/
+
+DocumentWriter guarda esas referencias y contadores una sola vez.
+StreamingDocumentWriter además escribe el .docx a medida que se arma.
+
+Los dos escriben un resultado reproducible: las imágenes se nombran por su
+SHA1 y todas las entradas del zip llevan la misma fecha fija, así las mismas
+imágenes con las mismas opciones dan un .docx idéntico byte a byte.
+"""
+import copy
+import io
+import shutil
+import tempfile
+import zipfile
+
+from lxml import etree
+
+from docx.enum.text import WD_BREAK
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.pkgwriter import PackageWriter
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.oxml.table import CT_Tbl
+from docx.parts.image import ImagePart
+from docx.shape import InlineShape
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+# Fecha de todas las entradas del zip (la mínima que admite el formato)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def zip_info(name, compress_type=zipfile.ZIP_DEFLATED):
+    """Entrada de zip con la fecha fija ZIP_DATE_TIME"""
+    info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+    info.compress_type = compress_type
+    return info
+
+
+def save_document(document, output_file):
+    """Equivalente a document.save(), con la fecha fija en cada entrada del zip"""
+    package = document.part.package
+    for part in package.parts:
+        part.before_marshal()
+    writer = _FixedDateZipWriter(output_file)
+    PackageWriter._write_content_types_stream(writer, package.parts)
+    PackageWriter._write_pkg_rels(writer, package.rels)
+    PackageWriter._write_parts(writer, package.parts)
+    writer.close()
+
+
+class _FixedDateZipWriter:
+    # Reemplaza al escritor zip de python-docx, que usa la hora actual en cada entrada
+
+    def __init__(self, output_file):
+        self._zip = zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, pack_uri, blob):
+        self._zip.writestr(zip_info(pack_uri.membername), blob)
+
+    def close(self):
+        self._zip.close()
+
+
+class DocumentWriter:
+    """Agrega párrafos e imágenes al final del cuerpo de un documento"""
+
+    def __init__(self, document):
+        self.document = document
+        self.part = document.part
+        self._body = document._body
+        # Los párrafos nuevos van justo antes de las propiedades de sección
+        self._sectPr = document.element.body.sectPr
+        # Ancho entre márgenes: los márgenes ya deben estar configurados
+        self._block_width = document._block_width
+        # Se consultan una sola vez; después se asignan en orden
+        self._next_shape_id = self.part.next_id
+        # SHA1 de la imagen -> rId, para incrustar cada imagen distinta una sola vez
+        self._rIds_by_sha1 = {}
+        # Imágenes que ya tenía el documento, por nombre (al agregar imágenes)
+        self._image_parts = {part.partname: part for part in self.part.package.image_parts}
+
+    def add_block(self, element):
+        """Agrega un bloque ya armado (w:p o w:tbl) al final del body"""
+        if self._sectPr is not None:
+            self._sectPr.addprevious(element)
+        else:
+            self.document.element.body.append(element)
+        return element
+
+    def add_paragraph(self):
+        """Equivalente a document.add_paragraph(), sin recorrer el body"""
+        return Paragraph(self.add_block(OxmlElement('w:p')), self._body)
+
+    def add_page_break(self):
+        """Equivalente a document.add_page_break()"""
+        paragraph = self.add_paragraph()
+        paragraph.add_run().add_break(WD_BREAK.PAGE)
+        return paragraph
+
+    def new_table(self, rows, cols):
+        """Tabla igual a la de add_table, todavía fuera del documento"""
+        table = Table(CT_Tbl.new_tbl(rows, cols, self._block_width), self._body)
+        table.style = None
+        return table
+
+    def add_table(self, rows, cols):
+        """Equivalente a document.add_table(), sin recorrer las secciones"""
+        table = self.new_table(rows, cols)
+        self.add_block(table._tbl)
+        return table
+
+    def flush(self):
+        """Sin efecto: el documento completo se escribe en save()"""
+
+    def save(self, output_file):
+        """Guarda el documento (ver save_document)"""
+        save_document(self.document, output_file)
+
+    def add_picture(self, run, picture, width, height):
+        """
+        Equivalente a run.add_picture(picture, width=width, height=height)
+        picture: ruta o stream con la imagen
+        """
+        inline = CT_Inline.new_pic_inline(*self.embed_image(picture, width, height))
+        run._r.add_drawing(inline)
+        return InlineShape(inline)
+
+    def embed_image(self, picture, width, height):
+        """
+        Incrusta la imagen (una sola vez por contenido) y le asigna el
+        siguiente id de forma. Retorna los valores de su wp:inline:
+        (id de forma, rId, nombre de archivo, ancho, alto en EMU)
+        """
+        rId, image = self._get_or_add_image(picture)
+        cx, cy = image.scaled_dimensions(width, height)
+        shape_id = self._next_shape_id
+        self._next_shape_id += 1
+        return shape_id, rId, image.filename, cx, cy
+
+    def _get_or_add_image(self, picture):
+        image = Image.from_file(picture)
+        rId = self._rIds_by_sha1.get(image.sha1)
+        if rId is None:
+            partname = PackURI(f"/word/media/image-{image.sha1}.{image.ext}")
+            image_part = self._image_parts.get(partname)
+            if image_part is None:
+                image_part = ImagePart.from_image(image, partname)
+                self.part.package.image_parts.append(image_part)
+            rId = self.part.relate_to(image_part, RT.IMAGE)
+            self._rIds_by_sha1[image.sha1] = rId
+        return rId, image
+
+
+# Tipos de contenido de las imágenes que puede producir python-docx (Image.ext)
+IMAGE_CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'tiff': 'image/tiff',
+}
+
+# Marca donde se insertan los bloques del body al escribir document.xml
+_BODY_MARKER = 'stream-body'
+
+_DOCUMENT_PART = 'word/document.xml'
+_DOCUMENT_RELS_PART = 'word/_rels/document.xml.rels'
+_CONTENT_TYPES_PART = '[Content_Types].xml'
+
+# Partes que se escriben en save() y no al empezar, porque cambian mientras se
+# arma el documento (el manifiesto de imágenes, ver docx_manifest.py)
+_DEFERRED_PARTS = ('docProps/custom.xml',)
+
+
+class StreamingDocumentWriter(DocumentWriter):
+    """
+    Variante de DocumentWriter que escribe el .docx a medida que se arma.
+
+    Cada imagen se escribe en el zip de salida apenas se agrega (y no queda
+    en memoria), y flush() serializa a un archivo temporal los bloques ya
+    terminados del body y los quita del árbol XML. Así la memoria usada no
+    crece con la cantidad de imágenes. Cada tabla (una página en modo recibos)
+    queda en memoria hasta que se agrega otro bloque después de ella, otra
+    tabla, o hasta save(); entonces se escribe completa.
+    """
+
+    def __init__(self, document, output_file):
+        super().__init__(document)
+        self.output_file = output_file
+        self._zip = zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED)
+        self._body_xml = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        self._image_rels = []
+        self._open_table = None
+
+        # Partes de la plantilla (estilos, tema, propiedades...) tal cual las
+        # guarda python-docx, con el body todavía vacío
+        self._template = io.BytesIO()
+        document.save(self._template)
+        with zipfile.ZipFile(self._template) as template:
+            self._template_rels = template.read(_DOCUMENT_RELS_PART)
+            self._write_content_types(template.read(_CONTENT_TYPES_PART))
+            for info in template.infolist():
+                if info.filename not in (_DOCUMENT_PART, _DOCUMENT_RELS_PART, _CONTENT_TYPES_PART) + _DEFERRED_PARTS:
+                    self._zip.writestr(zip_info(info.filename), template.read(info.filename))
+
+    def add_block(self, element):
+        """Igual que DocumentWriter.add_block; una tabla se escribe cuando termina"""
+        if element.tag == qn('w:tbl'):
+            if self._open_table is not None:
+                self._close_table()
+            self._open_table = element
+        return super().add_block(element)
+
+    def flush(self):
+        """Escribe y libera los bloques del body ya terminados"""
+        body = self.document.element.body
+        after_open_table = False
+        for child in list(body):
+            if child is self._sectPr:
+                continue
+            if child is self._open_table:
+                after_open_table = True
+                continue
+            if after_open_table:
+                # Hay bloques después de la tabla: la tabla ya terminó
+                self._close_table()
+                after_open_table = False
+            self._body_xml.write(etree.tostring(child, encoding='UTF-8'))
+            body.remove(child)
+
+    def save(self, output_file=None):
+        """Termina de escribir el .docx (output_file se ignora, ya se indicó al crear)"""
+        self.flush()
+        if self._open_table is not None:
+            self._close_table()
+
+        self._write_document_xml()
+        self._write_document_rels()
+        for part in self.document.part.package.iter_parts():
+            if part.partname[1:] in _DEFERRED_PARTS:
+                self._zip.writestr(zip_info(part.partname[1:]), part.blob)
+        self._zip.close()
+        self._body_xml.close()
+
+    def _close_table(self):
+        self._body_xml.write(etree.tostring(self._open_table, encoding='UTF-8'))
+        self.document.element.body.remove(self._open_table)
+        self._open_table = None
+
+    def _get_or_add_image(self, picture):
+        image = Image.from_file(picture)
+        rId = self._rIds_by_sha1.get(image.sha1)
+        if rId is None:
+            rId = f"rIdImg{len(self._image_rels) + 1}"
+            target = f"media/image-{image.sha1}.{image.ext}"
+            self._zip.writestr(zip_info(f"word/{target}"), image.blob)
+            self._image_rels.append((rId, target))
+            self._rIds_by_sha1[image.sha1] = rId
+        return rId, image
+
+    def _write_content_types(self, template_xml):
+        types = etree.fromstring(template_xml)
+        ns = types.nsmap[None]
+        declared = {default.get('Extension') for default in types.findall(f'{{{ns}}}Default')}
+        for ext, content_type in IMAGE_CONTENT_TYPES.items():
+            if ext not in declared:
+                etree.SubElement(types, f'{{{ns}}}Default', Extension=ext, ContentType=content_type)
+        # Los Default deben ir antes que los Override
+        types[:] = sorted(types, key=lambda el: etree.QName(el).localname != 'Default')
+        self._zip.writestr(zip_info(_CONTENT_TYPES_PART), _xml_bytes(types))
+
+    def _write_document_xml(self):
+        root = copy.deepcopy(self.document.element)
+        body = root.body
+        for child in list(body):
+            body.remove(child)
+        body.append(etree.Comment(_BODY_MARKER))
+        if self._sectPr is not None:
+            body.append(copy.deepcopy(self._sectPr))
+        head, tail = _xml_bytes(root).split(f'<!--{_BODY_MARKER}-->'.encode())
+
+        self._body_xml.seek(0)
+        with self._zip.open(zip_info(_DOCUMENT_PART), 'w') as part:
+            part.write(head)
+            shutil.copyfileobj(self._body_xml, part)
+            part.write(tail)
+
+    def _write_document_rels(self):
+        rels = etree.fromstring(self._template_rels)
+        ns = rels.nsmap[None]
+        for rId, target in self._image_rels:
+            etree.SubElement(rels, f'{{{ns}}}Relationship', Id=rId, Type=RT.IMAGE, Target=target)
+        self._zip.writestr(zip_info(_DOCUMENT_RELS_PART), _xml_bytes(rels))
+
+
+def _xml_bytes(element):
+    return etree.tostring(element, encoding='UTF-8', xml_declaration=True, standalone=True)
@@ -0,0 +1,48 @@
+"""
+Configuración de gunicorn para servir la aplicación en producción (Linux/macOS):
+
+    gunicorn -c gunicorn.conf.py app:app
+
+`python app.py` sigue siendo el servidor de desarrollo que usan los lanzadores
+de Windows y macOS. Aquí cada proceso (WEB_WORKERS) atiende las peticiones con
+un pool de hilos (WEB_THREADS); las conversiones que corren a la vez y las que
+esperan turno las limita app.admission (CONVERT_SLOTS, CONVERT_QUEUE,
+CONVERT_QUEUE_MB), que responde 503 con Retry-After cuando la cola está llena.
+
+Los trabajos de /jobs viven en la memoria del proceso que los recibió: con más
+de un proceso, las consultas de un trabajo tienen que llegar al mismo (o usar
+/convert). Por eso el valor por defecto es un proceso; la preparación de
+imágenes ya usa todos los núcleos con su propio pool (IMAGE_WORKERS).
+
+Con SIGTERM gunicorn deja de aceptar conexiones y espera hasta
+GRACEFUL_TIMEOUT segundos a que terminen las peticiones en curso; antes de
+salir, cada proceso espera además sus trabajos de /jobs (app.shutdown).
+"""
+import os
+
+from admission import DEFAULT_QUEUE, DEFAULT_SLOTS
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_WORKERS', 1))
+worker_class = 'gthread'
+# Hilos suficientes para las conversiones admitidas y, además, para las
+# consultas livianas (/jobs/<id>, /uploads, /metrics) mientras esperan turno
+threads = int(os.environ.get(
+    'WEB_THREADS',
+    int(os.environ.get('CONVERT_SLOTS', DEFAULT_SLOTS)) + int(os.environ.get('CONVERT_QUEUE', DEFAULT_QUEUE)) + 4))
+# Conexiones pendientes de aceptar en el socket
+backlog = int(os.environ.get('WEB_BACKLOG', 64))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 300))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+keepalive = 5
+# Cada proceso crea sus propios hilos de trabajos y barrido: no precargar la app antes del fork
+preload_app = False
+
+
+def worker_exit(server, worker):
+    # Las peticiones en curso ya terminaron; esperar los trabajos de /jobs (el
+    # árbitro mata el proceso igual si se pasa de graceful_timeout)
+    from app import shutdown
+
+    if not shutdown(graceful_timeout):
+        server.log.warning('Quedaron conversiones sin terminar al cerrar el proceso %s', worker.pid)
@@ -0,0 +1,233 @@
+"""
+Caché en disco de imágenes preparadas y su metadata.
+
+Las entradas se guardan por el hash del contenido de la imagen (no por su
+nombre ni su ruta temporal), así que la misma exportación de WhatsApp subida
+de nuevo —primero a /analyze_metadata, luego a /convert en cada modo— reutiliza
+el trabajo ya hecho:
+
+- info: formato, dimensiones y campos EXIF de la imagen
+- picture: bytes re-codificados para una caja y un perfil de calidad dados
+
+Los procesos del pool leen y escriben las entradas directamente; el proceso
+principal lleva los contadores (a partir de cada registro) y hace la
+expulsión LRU por tamaño total, usando la fecha de modificación de cada
+archivo como fecha del último uso.
+
+Cada entrada es una línea JSON seguida de sus valores bytes sin codificar
+(nunca pickle: leer el caché no ejecuta nada de lo que haya en el
+directorio), y el directorio es solo del usuario actual (private_directory).
+"""
+from datetime import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from image_source import open_source
+
+# Cambiar si cambia el resultado de la preparación o el formato de las entradas, para invalidar el caché
+CACHE_VERSION = 4
+
+# Tamaño máximo por defecto del caché
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+_ENTRY_SUFFIX = '.entry'
+
+# Entradas pickle de versiones anteriores: nunca se leen, evict las borra
+_LEGACY_SUFFIX = '.pkl'
+
+
+def file_digest(filepath):
+    """SHA1 del contenido del archivo (ruta o image_source.MemoryImage)"""
+    sha1 = hashlib.sha1()
+    with open_source(filepath) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def private_directory(directory):
+    """
+    Crea directory accesible solo por el usuario actual (0o700), o verifica
+    que el que ya existe sea suyo y le quita el acceso a los demás. Los
+    directorios por defecto están en el temporal compartido, donde otro usuario
+    del sistema podría crearlos antes y dejar entradas preparadas.
+    Lanza PermissionError si el directorio (o el enlace) es de otro usuario
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        # Windows: el temporal ya es por usuario
+        return
+    uid = os.getuid()
+    link, target = os.lstat(directory), os.stat(directory)
+    if link.st_uid != uid or target.st_uid != uid:
+        raise PermissionError(f"El directorio {directory} es de otro usuario; usar otro directorio")
+    if target.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def _encode_value(value):
+    # Valores de las entradas que JSON no representa (las fechas EXIF)
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Valor no admitido en el caché: {type(value).__name__}")
+
+
+def _decode_object(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+def info_key(digest):
+    """Clave de la entrada con formato, dimensiones y EXIF de la imagen"""
+    return f"info-{digest}-v{CACHE_VERSION}"
+
+
+def picture_key(digest, box, profile):
+    """
+    Clave de la imagen preparada: depende de la caja (ancho, alto en EMU)
+    y de la configuración del perfil, no del nombre del modo
+    """
+    params = repr((tuple(int(v) for v in box), sorted(profile.items()) if profile else None))
+    return f"picture-{digest}-{hashlib.sha1(params.encode()).hexdigest()[:16]}-v{CACHE_VERSION}"
+
+
+class ImageCache:
+    """
+    Caché de entradas (diccionarios) en un directorio, con tamaño acotado.
+
+    Se envía por pickle a los procesos del pool: solo viajan el directorio
+    y el límite, los contadores quedan en el proceso principal.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        private_directory(directory)
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['max_bytes'])
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Retorna la entrada guardada con esa clave, o None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline(), object_hook=_decode_object)
+                entry = header['fields']
+                for name, size in header['bytes']:
+                    entry[name] = f.read(size)
+                    if len(entry[name]) != size:
+                        return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        try:
+            # Marcar como usada recientemente (orden LRU)
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        """
+        Guarda la entrada (escritura atómica, segura entre procesos). Los
+        valores bytes van sin codificar después de la línea JSON con el resto
+        """
+        fields = {name: value for name, value in entry.items() if not isinstance(value, bytes)}
+        blobs = [(name, value) for name, value in entry.items() if isinstance(value, bytes)]
+        try:
+            header = json.dumps({'fields': fields, 'bytes': [[name, len(value)] for name, value in blobs]},
+                                default=_encode_value)
+        except (TypeError, ValueError):
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.encode() + b'\n')
+                for _, value in blobs:
+                    f.write(value)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def count(self, record):
+        """Suma los aciertos/fallos informados por un registro de build_image_record"""
+        cache_stats = record.get('cache') or {}
+        with self._lock:
+            self.hits += cache_stats.get('hits', 0)
+            self.misses += cache_stats.get('misses', 0)
+
+    def evict(self):
+        """Borra las entradas usadas hace más tiempo hasta quedar bajo max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(_LEGACY_SUFFIX):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                    continue
+                if not entry.name.endswith(_ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self):
+        """Contadores y ocupación actual del caché"""
+        entries = 0
+        size = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(_ENTRY_SUFFIX):
+                    entries += 1
+                    try:
+                        size += entry.stat().st_size
+                    except OSError:
+                        pass
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
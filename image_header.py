@@ -0,0 +1,201 @@
+"""
+Lectura rápida de dimensiones y EXIF leyendo solo la cabecera del archivo.
+
+Para analizar metadata no hace falta que Pillow construya la imagen ni que
+recorra todas las etiquetas EXIF: basta con los bytes de la cabecera (JPEG,
+PNG, GIF, BMP) y, dentro del bloque EXIF (TIFF), solo las entradas que usa
+image_metadata (fechas, autor y orientación). Los demás formatos (WebP, TIFF...) retornan
+None y se leen con Pillow.
+"""
+import struct
+from datetime import datetime
+
+from image_source import open_source
+
+# Etiquetas TIFF/EXIF que se leen
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_ARTIST = 0x013B
+TAG_XP_AUTHOR = 0x9C9D
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_USER_COMMENT = 0x9286
+
+# Bytes por valor de cada tipo TIFF
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+# Marcadores JPEG SOFn (los que traen alto y ancho)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_image_header(filepath, read_exif=True):
+    """
+    Lee formato, dimensiones y campos EXIF sin decodificar la imagen.
+
+    Args:
+        filepath: Ruta de la imagen (o image_source.MemoryImage)
+        read_exif: Leer también el bloque EXIF (False = solo dimensiones)
+
+    Retorna {'format', 'width', 'height', 'exif'}, donde exif tiene la misma
+    forma que image_metadata.read_exif_fields (o None si no se leyó), o None
+    si el formato no se reconoce o la cabecera está dañada.
+    """
+    try:
+        with open_source(filepath) as f:
+            head = f.read(32)
+            if head[:3] == b'\xff\xd8\xff':
+                return _read_jpeg(f, read_exif)
+            if head[:8] == b'\x89PNG\r\n\x1a\n':
+                return _read_png(f, read_exif)
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                width, height = struct.unpack('<HH', head[6:10])
+                return _header('GIF', width, height, read_exif)
+            if head[:2] == b'BM':
+                width, height = struct.unpack('<ii', head[18:26])
+                return _header('BMP', width, abs(height), read_exif)
+    except (OSError, struct.error, ValueError):
+        pass
+    return None
+
+
+def _header(image_format, width, height, read_exif, exif=None):
+    if read_exif and exif is None:
+        exif = {'datetime': None, 'sender': None, 'orientation': 1}
+    return {'format': image_format, 'width': width, 'height': height, 'exif': exif if read_exif else None}
+
+
+def _read_jpeg(f, read_exif):
+    f.seek(2)
+    exif = None
+    while True:
+        marker = f.read(2)
+        while marker[:1] == b'\xff' and marker[1:] == b'\xff':
+            # Bytes de relleno entre marcadores
+            marker = marker[1:] + f.read(1)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code in (0xD9, 0xDA):
+            # Fin de imagen o inicio de los datos sin haber encontrado SOF
+            return None
+        length = struct.unpack('>H', f.read(2))[0]
+        if length < 2:
+            return None
+
+        if code in _SOF_MARKERS:
+            height, width = struct.unpack('>xHH', f.read(5))
+            return _header('JPEG', width, height, read_exif, exif)
+        if code == 0xE1 and read_exif and exif is None:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                exif = parse_exif(segment[6:])
+            continue
+        f.seek(length - 2, 1)
+
+
+def _read_png(f, read_exif):
+    f.seek(8)
+    width = height = None
+    exif = None
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', chunk_header)
+        if chunk_type == b'IHDR':
+            width, height = struct.unpack('>II', f.read(8))
+            f.seek(length - 8 + 4, 1)
+            if not read_exif:
+                break
+        elif chunk_type == b'eXIf' and read_exif:
+            exif = parse_exif(f.read(length))
+            break
+        elif chunk_type == b'IDAT':
+            break
+        else:
+            f.seek(length + 4, 1)
+    if width is None:
+        return None
+    return _header('PNG', width, height, read_exif, exif)
+
+
+def parse_exif(data):
+    """
+    Lee de un bloque EXIF (TIFF) solo las fechas, el autor y la orientación.
+    Misma prioridad que recorrer img._getexif(): la fecha original gana sobre
+    DateTime, y UserComment sobre XPAuthor sobre Artist.
+    """
+    fields = {'datetime': None, 'sender': None, 'orientation': 1}
+    if data[:2] == b'II':
+        order = '<'
+    elif data[:2] == b'MM':
+        order = '>'
+    else:
+        return fields
+
+    try:
+        if struct.unpack(order + 'H', data[2:4])[0] != 42:
+            return fields
+        ifd0 = _read_ifd(data, order, struct.unpack(order + 'I', data[4:8])[0],
+                         (TAG_ORIENTATION, TAG_DATETIME, TAG_ARTIST, TAG_XP_AUTHOR, TAG_EXIF_IFD))
+        exif_ifd = {}
+        if TAG_EXIF_IFD in ifd0:
+            exif_ifd = _read_ifd(data, order, _as_int(ifd0[TAG_EXIF_IFD]),
+                                 (TAG_DATETIME_ORIGINAL, TAG_USER_COMMENT))
+    except (struct.error, ValueError, IndexError):
+        return fields
+
+    for tag, value in ((TAG_DATETIME, ifd0.get(TAG_DATETIME)),
+                       (TAG_DATETIME_ORIGINAL, exif_ifd.get(TAG_DATETIME_ORIGINAL))):
+        if isinstance(value, str):
+            try:
+                fields['datetime'] = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+            except ValueError:
+                pass
+
+    if ifd0.get(TAG_ORIENTATION) in range(1, 9):
+        fields['orientation'] = ifd0[TAG_ORIENTATION]
+    if isinstance(ifd0.get(TAG_ARTIST), str):
+        fields['sender'] = ifd0[TAG_ARTIST]
+    if isinstance(ifd0.get(TAG_XP_AUTHOR), bytes):
+        try:
+            fields['sender'] = ifd0[TAG_XP_AUTHOR].decode('utf-16le').rstrip('\x00')
+        except UnicodeDecodeError:
+            pass
+    if isinstance(exif_ifd.get(TAG_USER_COMMENT), bytes):
+        fields['sender'] = exif_ifd[TAG_USER_COMMENT].decode('utf-8', errors='ignore')
+    return fields
+
+
+def _read_ifd(data, order, offset, wanted):
+    # Retorna {etiqueta: valor} solo para las etiquetas pedidas
+    values = {}
+    count = struct.unpack(order + 'H', data[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, value_type, value_count = struct.unpack(order + 'HHI', data[entry:entry + 8])
+        if tag not in wanted or value_type not in _TYPE_SIZES:
+            continue
+        size = _TYPE_SIZES[value_type] * value_count
+        if size <= 4:
+            raw = data[entry + 8:entry + 8 + size]
+        else:
+            value_offset = struct.unpack(order + 'I', data[entry + 8:entry + 12])[0]
+            raw = data[value_offset:value_offset + size]
+            if len(raw) < size:
+                continue
+
+        if value_type == 2:
+            # ASCII, terminado en NUL
+            values[tag] = raw.split(b'\x00', 1)[0].decode('latin-1')
+        elif value_type in (1, 7):
+            values[tag] = bytes(raw)
+        elif value_type in (3, 4) and value_count == 1:
+            values[tag] = struct.unpack(order + ('H' if value_type == 3 else 'I'), raw)[0]
+    return values
+
+
+def _as_int(value):
+    if not isinstance(value, int):
+        raise ValueError('Puntero IFD no válido')
+    return value
@@ -0,0 +1,139 @@
+"""
+Extracción de metadata (fecha/hora y remitente) de las imágenes.
+"""
+from PIL import Image
+from PIL.ExifTags import TAGS
+import logging
+from datetime import datetime
+import re
+
+from image_source import open_source, source_mtime, source_name
+
+logger = logging.getLogger(__name__)
+
+# Nombre de las imágenes de WhatsApp: IMG-YYYYMMDD-WA####
+WHATSAPP_PATTERN = re.compile(r'IMG-(\d{8})-WA\d+')
+
+def filename_datetime(filename):
+    """
+    Fecha tomada del nombre del archivo (formato de WhatsApp), o None
+    """
+    match = WHATSAPP_PATTERN.search(filename)
+    if match:
+        date_str = match.group(1)
+        try:
+            return datetime.strptime(date_str, '%Y%m%d')
+        except:
+            pass
+    return None
+
+def read_exif_fields(img):
+    """
+    Lee de EXIF los campos que dependen solo del contenido de la imagen
+    (no del nombre ni de la fecha del archivo), para poder guardarlos en caché
+    img: imagen PIL ya abierta
+    Retorna un diccionario {'datetime': ..., 'sender': ..., 'orientation': ...}
+    (None si no están; orientación EXIF 1 si no está)
+    """
+    fields = {'datetime': None, 'sender': None, 'orientation': 1}
+    
+    # Formatos sin EXIF (BMP, GIF...)
+    if not hasattr(img, '_getexif'):
+        return fields
+    exif_data = img._getexif()
+    
+    if exif_data:
+        for tag_id, value in exif_data.items():
+            tag = TAGS.get(tag_id, tag_id)
+            
+            # Buscar fecha/hora original
+            if tag == 'DateTimeOriginal' or tag == 'DateTime':
+                try:
+                    fields['datetime'] = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+                except:
+                    pass
+            
+            # Orientación (5 a 8 intercambian ancho y alto)
+            elif tag == 'Orientation':
+                if value in range(1, 9):
+                    fields['orientation'] = value
+            
+            # Buscar información del autor/creador
+            elif tag == 'Artist' or tag == 'Author':
+                fields['sender'] = value
+            
+            # XPAuthor (Windows)
+            elif tag == 'XPAuthor':
+                try:
+                    fields['sender'] = value.decode('utf-16le').rstrip('\x00')
+                except:
+                    pass
+            
+            # UserComment puede contener información adicional
+            elif tag == 'UserComment':
+                try:
+                    if isinstance(value, bytes):
+                        comment = value.decode('utf-8', errors='ignore')
+                        fields['sender'] = comment
+                except:
+                    pass
+    
+    return fields
+
+def extract_image_metadata(filepath, img=None, exif_fields=None):
+    """
+    Extrae metadata de una imagen (EXIF, nombre del archivo, fecha de modificación)
+    filepath: ruta de la imagen (o image_source.MemoryImage)
+    img: imagen PIL ya abierta desde filepath (opcional, evita volver a abrirla)
+    exif_fields: resultado de read_exif_fields ya calculado (opcional, p. ej.
+        desde el caché; no se abre la imagen)
+    Retorna un diccionario con la información disponible; datetime_source
+    indica de dónde salió datetime: 'filename', 'exif', 'file_mtime' o None
+    """
+    metadata = {
+        'sender': None,
+        'datetime': None,
+        'datetime_source': None,
+        'filename': source_name(filepath),
+        'file_mtime': None
+    }
+    
+    try:
+        # Obtener fecha de modificación del archivo
+        metadata['file_mtime'] = datetime.fromtimestamp(source_mtime(filepath))
+        
+        # Intentar extraer información del nombre del archivo
+        # WhatsApp suele guardar imágenes como: IMG-20231225-WA0001.jpg
+        # O con formato de timestamp
+        filename = source_name(filepath)
+        
+        # Buscar patrones de WhatsApp en el nombre
+        metadata['datetime'] = filename_datetime(filename)
+        if metadata['datetime'] is not None:
+            metadata['datetime_source'] = 'filename'
+        
+        # Si el nombre ya trae la fecha no se lee el EXIF (WhatsApp lo elimina)
+        if metadata['datetime'] is None:
+            if exif_fields is None:
+                if img is None:
+                    with open_source(filepath) as f, Image.open(f) as img:
+                        exif_fields = read_exif_fields(img)
+                else:
+                    exif_fields = read_exif_fields(img)
+            
+            if exif_fields['datetime'] is not None:
+                metadata['datetime'] = exif_fields['datetime']
+                metadata['datetime_source'] = 'exif'
+            if exif_fields['sender'] is not None:
+                metadata['sender'] = exif_fields['sender']
+    
+        # Si no encontramos fecha en EXIF, usar la fecha de modificación
+        # (no depende del contenido: en las subidas es la fecha de recepción)
+        if not metadata['datetime']:
+            metadata['datetime'] = metadata['file_mtime']
+            metadata['datetime_source'] = 'file_mtime'
+            
+    except Exception as e:
+        logger.warning("Error extrayendo metadata de %s: %s", filepath, e)
+    
+    return metadata
@@ -0,0 +1,203 @@
+"""
+Preparación de imágenes antes de insertarlas en el documento Word.
+
+Cada imagen se redimensiona al tamaño real con el que se imprime (según los
+DPI del perfil elegido) y se re-codifica en memoria, en lugar de incrustar
+el archivo original de varios megapíxeles.
+"""
+import io
+
+from PIL import Image
+
+from image_source import source_size
+
+# Unidades internas de Word (EMU) por pulgada
+EMU_PER_INCH = 914400
+
+# Perfiles de calidad disponibles
+# dpi: resolución de salida para el tamaño impreso de la imagen
+# jpeg_quality: calidad al re-codificar en JPEG
+# png_to_jpeg: convertir a JPEG las imágenes sin transparencia (fotos en PNG)
+QUALITY_PROFILES = {
+    'print': {'dpi': 300, 'jpeg_quality': 85, 'png_to_jpeg': True},
+    'screen': {'dpi': 150, 'jpeg_quality': 75, 'png_to_jpeg': True},
+    'original': None,  # Incrustar el archivo original sin modificar (de varios cuadros, solo el primero)
+}
+
+DEFAULT_PROFILE = 'print'
+
+# Orientación EXIF -> transposición que deja la imagen derecha (la misma que
+# aplica ImageOps.exif_transpose)
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# Píxeles que se aceptan decodificar por imagen (50 MP, unos 200 MB en RGBA).
+# Se compara con lo que realmente se decodifica: las fotos JPEG grandes se
+# decodifican ya reducidas (ver reduce_decode)
+MAX_DECODE_PIXELS = 50_000_000
+
+
+class ImageTooLargeError(ValueError):
+    """La imagen pasa MAX_DECODE_PIXELS; se rechaza sin decodificarla"""
+
+
+def get_profile(name):
+    """
+    Retorna la configuración del perfil de calidad indicado
+    (None para 'original'). Lanza ValueError si el perfil no existe.
+    """
+    if name not in QUALITY_PROFILES:
+        raise ValueError(f"Perfil de calidad desconocido: {name}")
+    return QUALITY_PROFILES[name]
+
+
+def fit_size(img_width, img_height, max_width, max_height):
+    """
+    Calcula el tamaño (en EMU) que ocupa una imagen dentro de una caja,
+    conservando su relación de aspecto.
+    """
+    aspect_ratio = img_width / img_height
+
+    # 1. Ajustar por ancho
+    target_width = max_width
+    target_height = int(target_width / aspect_ratio)
+
+    # 2. Si es muy alta, ajustar por alto
+    if target_height > max_height:
+        target_height = max_height
+        target_width = int(target_height * aspect_ratio)
+
+    return int(target_width), int(target_height)
+
+
+def oriented_size(width, height, orientation):
+    """Ancho y alto con que se ve la imagen según su orientación EXIF"""
+    return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+
+
+def pixel_size(target_width, target_height, profile):
+    """Píxeles necesarios para imprimir target_width x target_height EMU con el perfil"""
+    dpi = profile['dpi']
+    return (max(1, round(target_width * dpi / EMU_PER_INCH)),
+            max(1, round(target_height * dpi / EMU_PER_INCH)))
+
+
+def reduce_decode(img, target_width, target_height, profile, orientation=1):
+    """
+    Se llama con la imagen abierta pero sin decodificar (Image.open solo lee
+    la cabecera). En JPEG pide al decodificador la menor escala (1/2, 1/4,
+    1/8) que todavía cubre el tamaño impreso; luego verifica que lo que se va
+    a decodificar no pase MAX_DECODE_PIXELS.
+
+    Args:
+        target_width, target_height: Tamaño impreso en EMU, ya orientado
+        orientation: Orientación EXIF de la imagen
+
+    Retorna True si la imagen se decodificará reducida.
+    Lanza ImageTooLargeError si pasa el límite.
+    """
+    width, height = oriented_size(*pixel_size(target_width, target_height, profile), orientation)
+    original_size = img.size
+    img.draft(img.mode, (width, height))  # No hace nada fuera de JPEG
+    check_decode_pixels(img, original_size)
+    return img.size != original_size
+
+
+def check_decode_pixels(img, original_size=None):
+    """
+    Lanza ImageTooLargeError si decodificar img, con el tamaño que tiene
+    ahora, pasa MAX_DECODE_PIXELS (original_size: el de la cabecera, para el mensaje)
+    """
+    if img.width * img.height > MAX_DECODE_PIXELS:
+        width, height = original_size or img.size
+        raise ImageTooLargeError(f"Imagen demasiado grande: {width}x{height} píxeles "
+                                 f"(máximo {MAX_DECODE_PIXELS // 1_000_000} MP)")
+
+
+def has_alpha(img):
+    """Indica si la imagen tiene canal de transparencia"""
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        return True
+    return img.mode == 'P' and 'transparency' in img.info
+
+
+def prepare_picture(filepath, img, target_width, target_height, profile, reuse_original=True, orientation=1):
+    """
+    Prepara la imagen para incrustarla con el tamaño indicado.
+
+    Args:
+        filepath: Ruta del archivo original (o image_source.MemoryImage)
+        img: Imagen PIL ya abierta desde filepath, sin rotar
+        target_width: Ancho impreso en EMU (ya orientado)
+        target_height: Alto impreso en EMU (ya orientado)
+        profile: Configuración de QUALITY_PROFILES (None = original)
+        reuse_original: Permitir incrustar el archivo original cuando resulta
+            más liviano (False si img ya fue modificada, p. ej. decodificada
+            reducida, o si el original tiene varios cuadros)
+        orientation: Orientación EXIF; la imagen se redimensiona tal como
+            está guardada y se gira ya reducida, en lugar de girar los
+            píxeles originales (el resultado ya no lleva orientación)
+
+    Retorna lo que se debe pasar a add_picture: la ruta original si no hace
+    falta tocar la imagen, o un BytesIO con la imagen re-codificada.
+    """
+    if profile is None:
+        if not getattr(img, 'is_animated', False):
+            return filepath
+        # GIF animado / TIFF multipágina: solo el primer cuadro, sin pérdida
+        # (PNG) y ya girado, porque el PNG no lleva la orientación EXIF
+        frame = img
+        if frame.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            frame = frame.convert('RGBA' if has_alpha(frame) else 'RGB')
+        transpose = ORIENTATION_TRANSPOSE.get(orientation)
+        if transpose is not None:
+            frame = frame.transpose(transpose)
+        buffer = io.BytesIO()
+        frame.save(buffer, format='PNG', optimize=True)
+        buffer.seek(0)
+        return buffer
+
+    dpi = profile['dpi']
+    max_px_width, max_px_height = oriented_size(*pixel_size(target_width, target_height, profile), orientation)
+    transpose = ORIENTATION_TRANSPOSE.get(orientation)
+
+    source_format = img.format
+    needs_resize = img.width > max_px_width or img.height > max_px_height
+
+    # Los GIF animados / TIFF multipágina solo aportan el primer cuadro
+    frame = img
+    alpha = has_alpha(frame)
+    if alpha:
+        frame = frame.convert('RGBA')
+    elif frame.mode not in ('RGB', 'L'):
+        frame = frame.convert('RGB')
+
+    if needs_resize:
+        frame = frame.resize((max_px_width, max_px_height), Image.LANCZOS)
+    if transpose is not None:
+        frame = frame.transpose(transpose)
+
+    buffer = io.BytesIO()
+    if source_format == 'JPEG' or (profile['png_to_jpeg'] and not alpha):
+        frame.save(buffer, format='JPEG', quality=profile['jpeg_quality'],
+                   optimize=True, dpi=(dpi, dpi))
+        output_format = 'JPEG'
+    else:
+        frame.save(buffer, format='PNG', optimize=True, dpi=(dpi, dpi))
+        output_format = 'PNG'
+
+    # Si no hubo que reducir y el original ya es más liviano en el mismo
+    # formato, incrustar el original tal cual
+    if (reuse_original and transpose is None and not needs_resize and source_format == output_format
+            and source_size(filepath) <= buffer.tell()):
+        return filepath
+
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,62 @@
+"""
+Origen de una imagen a convertir: una ruta en disco o una imagen subida que
+se conserva en memoria (MemoryImage).
+
+Las subidas pequeñas no se escriben a disco: sus bytes pasan directo a la
+lectura de cabecera y metadata, a Pillow y al documento. Todo lo que lee una
+imagen usa estas funciones, que aceptan los dos tipos de origen.
+"""
+import io
+import os
+import time
+
+
+class MemoryImage:
+    """
+    Imagen subida que se mantiene en memoria. key la identifica dentro de la
+    conversión (dos subidas con el mismo nombre son imágenes distintas) y name
+    es el nombre original, el que se usa para las fechas de WhatsApp y los
+    mensajes. Se envía por pickle, con sus bytes, a los procesos del pool.
+    """
+    __slots__ = ('key', 'name', 'data', 'mtime')
+
+    def __init__(self, key, name, data, mtime=None):
+        self.key = key
+        self.name = name
+        self.data = data
+        # Sin archivo, la "fecha de modificación" es la de recepción
+        self.mtime = time.time() if mtime is None else mtime
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryImage) and other.key == self.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"MemoryImage({self.key!r}, {len(self.data)} bytes)"
+
+
+def source_name(source):
+    """Nombre del archivo de la imagen"""
+    return source.name if isinstance(source, MemoryImage) else os.path.basename(source)
+
+
+def source_size(source):
+    """Tamaño en bytes de la imagen"""
+    return len(source.data) if isinstance(source, MemoryImage) else os.path.getsize(source)
+
+
+def source_mtime(source):
+    """Fecha de modificación (timestamp) de la imagen"""
+    return source.mtime if isinstance(source, MemoryImage) else os.stat(source).st_mtime
+
+
+def open_source(source):
+    """Abre la imagen para leerla en binario (usar con with)"""
+    return io.BytesIO(source.data) if isinstance(source, MemoryImage) else open(source, 'rb')
+
+
+def source_file(source):
+    """Lo que se pasa a add_picture para incrustar la imagen tal cual: ruta o stream"""
+    return io.BytesIO(source.data) if isinstance(source, MemoryImage) else source
@@ -1,33 +1,33 @@
 import os
-from docx import Document
-from docx.shared import Mm
-from PIL import Image
-import sys
-
-def images_to_word(image_folder, output_file):
-    document = Document()
-    
-    # Set narrow margins (e.g., 10mm) to maximize space
-    section = document.sections[0]
-    section.left_margin = Mm(10)
-    section.right_margin = Mm(10)
-    section.top_margin = Mm(10)
-    section.bottom_margin = Mm(10)
-
-    # Page dimensions (A4 by default in python-docx)
-    page_width = section.page_width
-    page_height = section.page_height
-    
-    # Calculate available width and height
-    available_width = page_width - section.left_margin - section.right_margin
-    available_height = page_height - section.top_margin - section.bottom_margin
-
-    valid_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff')
-    
-    # Get list of image files
+import argparse
+import copy
+import shutil
+import tempfile
+from functools import partial
+
+from converter import allowed_file, build_image_records, convert_images, volume_path
+from image_cache import DEFAULT_CACHE_BYTES, ImageCache
+from image_prep import DEFAULT_PROFILE, QUALITY_PROFILES
+from layout import DEFAULT_GRID, RECEIPT_GRIDS
+from pipeline import DEFAULT_WORKERS, StageTimer, imap_ordered
+from sort_order import natural_key
+
+# How batch mode splits the images of one folder into documents
+SPLIT_MODES = ('folder', 'day', 'month', 'count')
+DEFAULT_SPLIT_SIZE = 500
+
+def list_images(folder):
+    """(filename, filepath) pairs of the images directly inside folder, in natural name order"""
+    with os.scandir(folder) as it:
+        files = [(entry.name, entry.path) for entry in it if entry.is_file() and allowed_file(entry.name)]
+    files.sort(key=lambda item: natural_key(item[0]))
+    return files
+
+def images_to_word(image_folder, output_file, quality=DEFAULT_PROFILE, workers=None, timer=None, streaming=False,
+                   cache=None, mode='standard', sort_by='name', grid=DEFAULT_GRID, append=False, limits=None):
+    # Get list of image files (sorted by name, numbers by value)
     try:
-        files = [f for f in os.listdir(image_folder) if f.lower().endswith(valid_extensions)]
-        files.sort() # Sort alphabetically
+        files = list_images(image_folder)
     except FileNotFoundError:
         print(f"Error: The folder '{image_folder}' was not found.")
         return
@@ -38,60 +38,266 @@ def images_to_word(image_folder, output_file):
 
     print(f"Found {len(files)} images. Processing...")
 
-    for i, filename in enumerate(files):
-        filepath = os.path.join(image_folder, filename)
-        
-        try:
-            # Open image to get dimensions
-            with Image.open(filepath) as img:
-                img_width, img_height = img.size
-                
-                # Calculate aspect ratio
-                aspect_ratio = img_width / img_height
-                
-                # Determine target dimensions to fit within available space
-                # 1. Try fitting by width
-                target_width = available_width
-                target_height = int(target_width / aspect_ratio)
-                
-                # 2. If height exceeds available height, fit by height
-                if target_height > available_height:
-                    target_height = available_height
-                    target_width = int(target_height * aspect_ratio)
-                
-                # Add image to document
-                document.add_picture(filepath, width=target_width, height=target_height)
-                
-                # Get the paragraph containing the image (it's the last one added)
-                last_paragraph = document.paragraphs[-1]
-                
-                # Center the image (optional but looks better)
-                last_paragraph.alignment = 1  # 1 is CENTER
-
-                # If it's not the first image, add a page break before this paragraph
-                if i > 0:
-                    last_paragraph.paragraph_format.page_break_before = True
-                
-                print(f"Added {filename}")
-
-                    
-        except Exception as e:
-            print(f"Failed to process {filename}: {e}")
+    # Same engine as the web app: images are prepared in a process pool and
+    # written into the document in order. When appending, only images missing
+    # from the existing document are added, and it is replaced when complete.
+    # With limits the images are split into output_001.docx, output_002.docx...
+    append_to = output_file if append and os.path.exists(output_file) else None
+    target = output_file + '.partial' if append_to else output_file
+    try:
+        volumes, processed, errors, _ = convert_images(files, target, mode, sort_by, quality, grid, workers, timer,
+                                                       streaming, cache=cache, append_to=append_to, limits=limits)
+        if append_to is not None and processed:
+            os.replace(target, output_file)
+    except Exception as e:
+        print(f"Error creating document: {e}")
+        return
+    finally:
+        # The partial document is only kept once it replaced the original
+        if append_to is not None and os.path.exists(target):
+            os.remove(target)
+
+    for error in errors:
+        print(f"Failed to process {error}")
+    if append_to is None and len(volumes) > 1:
+        print(f"Successfully created {len(volumes)} volumes from '{volumes[0]}' to '{volumes[-1]}' "
+              f"({processed} of {len(files)} images)")
+    elif append_to is None:
+        print(f"Successfully created '{output_file}' ({processed} of {len(files)} images)")
+    elif processed:
+        print(f"Added {processed} new images to '{output_file}'")
+    elif errors:
+        print(f"None of the {len(errors)} new images could be added to '{output_file}'; it was left unchanged")
+    else:
+        print(f"No new images for '{output_file}'")
+
+def split_files(files, split='folder', split_size=DEFAULT_SPLIT_SIZE, workers=None, cache=None):
+    """
+    Splits the images of one folder into documents.
+    Returns a list of (name suffix, files): one document for 'folder', one per
+    day or month of the image date for 'day'/'month', or one per split_size
+    images for 'count'. Images without a date in EXIF or the file name go to
+    '_undated': their file modification time is not the image date and
+    changes when files are copied.
+    """
+    if split == 'folder':
+        return [('', files)]
+    if split == 'count':
+        return [(f"_{n + 1:03d}", files[start:start + split_size])
+                for n, start in enumerate(range(0, len(files), split_size))]
+
+    # Dates come from the file headers (no full decode), as in /analyze_metadata
+    date_format = '%Y-%m-%d' if split == 'day' else '%Y-%m'
+    groups = {}
+    for item, record in zip(files, build_image_records(files, workers=workers, cache=cache)):
+        metadata = record['metadata'] or {}
+        image_datetime = metadata.get('datetime') if metadata.get('datetime_source') != 'file_mtime' else None
+        key = image_datetime.strftime(date_format) if image_datetime else None
+        groups.setdefault(key, []).append(item)
+    return [(f"_{key}" if key else '_undated', groups[key])
+            for key in sorted(groups, key=lambda key: (key is None, key or ''))]
 
+def plan_batch(root, output_dir, split='folder', split_size=DEFAULT_SPLIT_SIZE, cache=None):
+    """
+    Walks root and returns the documents to build as (output_path, folder, files).
+    Each folder with images gets its own documents, at the same relative path
+    under output_dir (images in root itself are named after root).
+    """
+    root_name = os.path.basename(os.path.abspath(root))
+    units = []
+    for folder, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        files = sorted(((name, os.path.join(folder, name)) for name in filenames if allowed_file(name)),
+                       key=lambda item: natural_key(item[0]))
+        if not files:
+            continue
+        relative = os.path.relpath(folder, root)
+        base = os.path.join(output_dir, root_name if relative == '.' else relative)
+        # Reading headers serially is cheaper than starting a pool per folder
+        for suffix, part in split_files(files, split, split_size, 1, cache):
+            units.append((base + suffix + '.docx', folder, part))
+    return units
+
+def existing_outputs(output_path):
+    """The files of a batch document on disk: output_path and/or its volumes"""
+    outputs = [output_path] if os.path.exists(output_path) else []
+    number = 1
+    while os.path.exists(volume_path(output_path, number)):
+        outputs.append(volume_path(output_path, number))
+        number += 1
+    return outputs
+
+def is_up_to_date(output_path, folder, files):
+    """
+    True if output_path (or all of its volumes) is newer than all of its images
+    and than the folder itself (its modification time changes when images are
+    added or removed)
+    """
+    try:
+        output_mtime = min(os.path.getmtime(path) for path in existing_outputs(output_path))
+    except (OSError, ValueError):
+        return False
+    try:
+        return all(os.path.getmtime(path) < output_mtime for path in [folder] + [f[1] for f in files])
+    except OSError:
+        return False
+
+def build_document(unit, options):
+    """Builds one batch document (runs in a process of the batch pool)"""
+    output_path, folder, files = unit
+    # A copy with its own counters (same directory), whether this runs in the
+    # pool or in the calling process; the caller adds them up
+    cache = copy.copy(options['cache'])
+    timer = StageTimer()
+    result = {'output': output_path, 'volumes': [], 'images': len(files), 'processed': 0, 'errors': [],
+              'error': None}
+    # Written into a temporary folder and moved when complete, so an
+    # interrupted run never leaves a document (or volume) that looks up to date
+    output_dir = os.path.dirname(output_path) or '.'
+    append_to = output_path if options['append'] and os.path.exists(output_path) else None
     try:
-        document.save(output_file)
-        print(f"Successfully created '{output_file}'")
+        os.makedirs(output_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix='.partial-', dir=output_dir) as temp_dir:
+            volumes, result['processed'], result['errors'], _ = convert_images(
+                files, os.path.join(temp_dir, os.path.basename(output_path)), options['mode'], options['sort_by'],
+                options['quality'], options['grid'], options['workers'], timer, options['streaming'], cache=cache,
+                append_to=append_to, limits=options['limits']
+            )
+            if append_to is not None and result['processed'] == 0 and not result['errors']:
+                # Nothing new (e.g. images were only removed): keep it, marked as up to date
+                os.utime(output_path)
+                result['volumes'] = [output_path]
+            elif result['processed'] == 0:
+                raise ValueError('no image could be processed')
+            else:
+                # Volumes of a previous run that are not rebuilt would look current
+                stale = existing_outputs(output_path)
+                for volume in volumes:
+                    path = os.path.join(output_dir, os.path.basename(volume))
+                    shutil.move(volume, path)
+                    result['volumes'].append(path)
+                for path in stale:
+                    if path not in result['volumes']:
+                        os.remove(path)
     except Exception as e:
-        print(f"Error saving document: {e}")
+        result['error'] = str(e)
+    result['timings'] = timer.totals
+    result['cache'] = {'hits': cache.hits, 'misses': cache.misses} if cache is not None else None
+    return result
+
+def batch_convert(root, output_dir, quality=DEFAULT_PROFILE, jobs=None, workers=None, timer=None, streaming=False,
+                  cache=None, mode='standard', sort_by='name', grid=DEFAULT_GRID, split='folder',
+                  split_size=DEFAULT_SPLIT_SIZE, force=False, append=False, limits=None):
+    """
+    Converts every folder with images under root into .docx files in output_dir.
+    Documents newer than their images are skipped (unless force). Up to jobs
+    documents are built at the same time, each in its own process; images are
+    then prepared serially inside each one (workers only applies with jobs=1).
+    With append, documents that already exist only get their new images.
+    With limits, documents over them are split into numbered volumes.
+    Returns the list of build_document results of the documents built.
+    """
+    if jobs is None:
+        jobs = DEFAULT_WORKERS
+    if not os.path.isdir(root):
+        print(f"Error: The folder '{root}' was not found.")
+        return []
+
+    units = plan_batch(root, output_dir, split, split_size, cache)
+    pending = [unit for unit in units if force or not is_up_to_date(*unit)]
+    print(f"Found {len(units)} documents to build, {len(units) - len(pending)} up to date.")
+
+    options = {
+        'mode': mode,
+        'sort_by': sort_by,
+        'quality': quality,
+        'grid': grid,
+        'streaming': streaming,
+        'workers': workers if jobs <= 1 else 1,
+        'cache': cache,
+        'append': append,
+        'limits': limits,
+    }
+    results = []
+    for result in imap_ordered(partial(build_document, options=options), pending, jobs):
+        if timer is not None:
+            timer.merge(result['timings'])
+        if cache is not None:
+            cache.count(result)
+        for error in result['errors']:
+            print(f"Failed to process {error}")
+        if result['error']:
+            print(f"Error creating '{result['output']}': {result['error']}")
+        elif len(result['volumes']) > 1:
+            print(f"Created {len(result['volumes'])} volumes of '{result['output']}' "
+                  f"({result['processed']} of {result['images']} images)")
+        else:
+            print(f"Created '{result['output']}' ({result['processed']} of {result['images']} images)")
+        results.append(result)
+    return results
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a folder of images into a Word document.")
     # Default to current directory if no arguments provided
-    folder = "."
-    if len(sys.argv) > 1:
-        folder = sys.argv[1]
-    
-    output = "output.docx"
-    if len(sys.argv) > 2:
-        output = sys.argv[2]
-        
-    images_to_word(folder, output)
+    parser.add_argument("folder", nargs="?", default=".")
+    parser.add_argument("output", nargs="?",
+                        help="output .docx (default output.docx), or output directory with --batch (default output)")
+    parser.add_argument("--quality", choices=sorted(QUALITY_PROFILES), default=DEFAULT_PROFILE,
+                        help="print (300 dpi), screen (150 dpi) or original (embed files unchanged; first frame of animations)")
+    parser.add_argument("--mode", choices=('standard', 'receipts'), default='standard',
+                        help="one image per page, or a grid of receipts per page")
+    parser.add_argument("--grid", choices=sorted(RECEIPT_GRIDS), default=DEFAULT_GRID,
+                        help="columns x rows per page in receipts mode")
+    parser.add_argument("--sort", choices=('name', 'metadata'), default='name',
+                        help="order by file name or by sent date (EXIF / WhatsApp file name)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="processes used to prepare images (1 = serial)")
+    parser.add_argument("--timings", action="store_true", help="print per-stage timings")
+    parser.add_argument("--streaming", action="store_true",
+                        help="write the .docx image by image (bounded memory)")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse prepared images across runs from this cache directory")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="maximum cache size in MB (least recently used entries are evicted)")
+    parser.add_argument("--batch", action="store_true",
+                        help="walk the folder tree and build one .docx per folder with images")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_WORKERS,
+                        help="documents built at the same time in batch mode (1 = use --workers per document)")
+    parser.add_argument("--split", choices=SPLIT_MODES, default='folder',
+                        help="batch mode: one document per folder, per day, per month or per --split-size images")
+    parser.add_argument("--split-size", type=int, default=DEFAULT_SPLIT_SIZE,
+                        help="images per document with --split count")
+    parser.add_argument("--force", action="store_true",
+                        help="batch mode: rebuild documents that are newer than their images")
+    parser.add_argument("--append", action="store_true",
+                        help="add only new images to an existing output document instead of rebuilding it")
+    parser.add_argument("--max-pages", type=int, default=0,
+                        help="split each document into volumes of at most this many pages")
+    parser.add_argument("--max-images", type=int, default=0,
+                        help="split each document into volumes of at most this many images")
+    parser.add_argument("--max-mb", type=float, default=0,
+                        help="split each document into volumes of at most this many MB of embedded images")
+    args = parser.parse_args()
+    if args.append and args.split == 'count':
+        # Parts by position shift when an image sorts before existing ones
+        parser.error("--append cannot be used with --split count")
+    limits = {key: value for key, value in (('max_pages', args.max_pages), ('max_images', args.max_images),
+                                            ('max_bytes', int(args.max_mb * 1024 * 1024))) if value > 0} or None
+    if args.append and limits:
+        parser.error("--append cannot be used with --max-pages, --max-images or --max-mb")
+
+    timer = StageTimer()
+    cache = ImageCache(args.cache, args.cache_mb * 1024 * 1024) if args.cache else None
+    if args.batch:
+        batch_convert(args.folder, args.output or 'output', args.quality, args.jobs, args.workers, timer,
+                      args.streaming, cache, args.mode, args.sort, args.grid, args.split, args.split_size, args.force,
+                      args.append, limits)
+    else:
+        images_to_word(args.folder, args.output or 'output.docx', args.quality, args.workers, timer, args.streaming,
+                       cache, args.mode, args.sort, args.grid, args.append, limits)
+    if cache is not None:
+        cache.evict()
+    if args.timings:
+        print(f"Timings: {timer.report()}")
+    if cache is not None:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses")
@@ -0,0 +1,140 @@
+"""
+Trabajos de conversión en segundo plano.
+
+POST /jobs guarda las imágenes subidas y encola la conversión en un pool de
+hilos; la petición vuelve enseguida con el id del trabajo. Cada trabajo lleva
+su propio directorio temporal, que se borra cuando pasa JOB_TTL segundos desde
+que terminó (ya no depende de que se cierre la respuesta, como en /convert).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+import threading
+import time
+import uuid
+
+# Conversiones simultáneas (cada una ya usa su propio pool de procesos)
+DEFAULT_JOB_WORKERS = 2
+
+# Segundos que se conservan el resultado y el directorio de un trabajo terminado
+DEFAULT_JOB_TTL = 3600
+
+# Estados posibles de un trabajo
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    """Estado y progreso de una conversión en segundo plano"""
+
+    def __init__(self, temp_dir, total):
+        self.id = uuid.uuid4().hex
+        self.temp_dir = temp_dir
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.processed = 0
+        self.total = total
+        self.errors = []
+        self.error = None
+        self.output_path = None
+        self.output_filename = None
+        self.timings = None
+        self.created = time.time()
+        self.finished = None
+
+    def update(self, stage, processed, total, errors):
+        """Callback de progreso para images_to_word"""
+        self.stage = stage
+        self.processed = processed
+        self.total = total
+        self.errors = errors
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'processed': self.processed,
+            'total': self.total,
+            'errors': list(self.errors),
+            'error': self.error,
+            'filename': self.output_filename,
+            'timings': self.timings,
+        }
+
+
+class JobStore:
+    """
+    Ejecuta trabajos en un pool de hilos y los conserva hasta que vence su TTL.
+    """
+
+    def __init__(self, workers=DEFAULT_JOB_WORKERS, ttl=DEFAULT_JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def submit(self, temp_dir, total, func, *args):
+        """
+        Encola func(job, *args) y retorna el Job creado.
+        func puede dejar en el job el resultado (output_path, output_filename);
+        si lanza una excepción el trabajo queda fallido con ese mensaje.
+        """
+        self.prune()
+        self._start_sweeper()
+        job = Job(temp_dir, total)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id):
+        """Retorna el Job con ese id, o None si no existe o ya venció"""
+        self.prune()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        """Cantidad de trabajos por estado (los 'queued' esperan un hilo libre)"""
+        counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def prune(self, now=None):
+        """Borra los trabajos terminados hace más de ttl segundos y sus archivos"""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished is not None and now - job.finished > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+        return len(expired)
+
+    def _run(self, job, func, args):
+        job.status = RUNNING
+        try:
+            func(job, *args)
+            job.status = DONE
+            job.stage = DONE
+        except Exception as e:
+            job.status = FAILED
+            job.stage = FAILED
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+
+    def _start_sweeper(self):
+        # Limpieza periódica, para no depender de que lleguen nuevas peticiones
+        def sweep():
+            while True:
+                time.sleep(max(1, min(self.ttl, 60)))
+                self.prune()
+
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=sweep, name='job-sweeper', daemon=True)
+                self._sweeper.start()
@@ -0,0 +1,99 @@
+"""
+Geometría de página de cada modo de organización.
+
+Se usa tanto al armar el documento como en los procesos que preparan las
+imágenes, para que ambos calculen exactamente la misma caja para cada imagen.
+"""
+from docx import Document
+from docx.shared import Mm, Pt
+
+# Márgenes de página por modo (recibos: SIN MÁRGENES, 100% de la hoja)
+PAGE_MARGINS = {
+    'standard': Mm(10),
+    'receipts': Mm(0),
+}
+
+# Espacio reservado para la fecha encima de cada imagen en modo recibos
+CAPTION_RESERVE = Mm(8)
+
+# Cuadrículas del modo recibos: columnas x filas por página
+RECEIPT_GRIDS = {
+    '2x2': (2, 2),
+    '2x3': (2, 3),
+    '3x3': (3, 3),
+    '3x4': (3, 4),
+}
+
+DEFAULT_GRID = '2x2'
+
+# En modo recibos cada página es una tabla. Word une dos tablas seguidas, así
+# que entre tablas va un párrafo mínimo (que además inicia la página); las
+# filas dejan este espacio libre para él
+GRID_SEPARATOR_HEIGHT = Pt(1)
+GRID_PAGE_RESERVE = Pt(2)
+
+_page_size = None
+
+
+def default_page_size():
+    """Ancho y alto de página de la plantilla por defecto de python-docx"""
+    global _page_size
+    if _page_size is None:
+        section = Document().sections[0]
+        _page_size = (section.page_width, section.page_height)
+    return _page_size
+
+
+def configure_section(section, mode):
+    """
+    Aplica los márgenes del modo a la sección.
+    Retorna (ancho disponible, alto disponible) en EMU.
+    """
+    margin = PAGE_MARGINS.get(mode, Mm(0))
+    section.left_margin = margin
+    section.right_margin = margin
+    section.top_margin = margin
+    section.bottom_margin = margin
+
+    available_width = section.page_width - section.left_margin - section.right_margin
+    available_height = section.page_height - section.top_margin - section.bottom_margin
+    return available_width, available_height
+
+
+def get_grid(name):
+    """
+    Retorna (columnas, filas) de la cuadrícula indicada.
+    Lanza ValueError si la cuadrícula no existe.
+    """
+    if name not in RECEIPT_GRIDS:
+        raise ValueError(f"Cuadrícula desconocida: {name}")
+    return RECEIPT_GRIDS[name]
+
+
+def grid_cell_size(available_width, available_height, grid=DEFAULT_GRID):
+    """
+    Ancho y alto (EMU) de cada celda de la cuadrícula, dejando lugar para
+    el párrafo que separa las tablas de cada página
+    """
+    cols, rows = get_grid(grid)
+    return int(available_width / cols), int((available_height - GRID_PAGE_RESERVE) / rows)
+
+
+def image_box(mode, has_caption=False, grid=DEFAULT_GRID):
+    """
+    Caja máxima (ancho, alto en EMU) que puede ocupar una imagen en el modo dado.
+    """
+    page_width, page_height = default_page_size()
+    margin = PAGE_MARGINS.get(mode, Mm(0))
+    available_width = page_width - 2 * margin
+    available_height = page_height - 2 * margin
+
+    if mode == 'standard':
+        # La fecha va en un párrafo aparte, la imagen usa todo el espacio
+        return available_width, available_height
+
+    # Recibos: una celda de la cuadrícula
+    max_img_width, max_img_height = grid_cell_size(available_width, available_height, grid)
+    if has_caption:
+        max_img_height = max_img_height - CAPTION_RESERVE
+    return max_img_width, max_img_height
@@ -0,0 +1,204 @@
+"""
+Métricas del servicio en formato de texto de Prometheus (/metrics).
+
+Un único registro por proceso (METRICS), con contadores, histogramas y
+valores que se calculan al momento de exportar (profundidad de la cola de
+trabajos, caché). Los procesos del pool no lo tocan: cada registro de imagen
+trae sus tiempos y tamaños de vuelta y se observa en el proceso principal.
+"""
+import bisect
+import cProfile
+import heapq
+import os
+import threading
+import time
+
+# Límites (le) de los histogramas, en segundos y en bytes
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+METRIC_PREFIX = 'imagenes_a_word_'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histograma acumulado (buckets fijos, suma y cantidad)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Registro de métricas del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._histogram_buckets = {}
+        self._gauges = {}
+
+    def describe(self, name, help_text, kind, buckets=None):
+        self._help[name] = (help_text, kind)
+        if buckets is not None:
+            self._histogram_buckets[name] = buckets
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self._histogram_buckets.get(name, SECONDS_BUCKETS))
+                self._histograms[key] = histogram
+            histogram.observe(value)
+
+    def gauge(self, name, func):
+        """func() retorna un número o una lista de (labels dict, valor); se evalúa al exportar"""
+        self._gauges[name] = func
+
+    def observe_timer(self, timer):
+        """Registra los segundos por etapa de un StageTimer (una conversión)"""
+        for stage, seconds in timer.totals.items():
+            self.observe('stage_seconds', seconds, stage=stage)
+
+    def observe_image(self, record, embed_seconds=None):
+        """Registra tiempos y tamaños de un registro de pipeline.build_image_record"""
+        timings = record.get('timings') or {}
+        if 'decode' in timings:
+            self.observe('image_decode_seconds', timings['decode'])
+        if 'resize' in timings:
+            self.observe('image_resize_seconds', timings['resize'])
+        if embed_seconds is not None:
+            self.observe('image_embed_seconds', embed_seconds)
+        if record.get('input_bytes') is not None:
+            self.observe('image_input_bytes', record['input_bytes'])
+        if record.get('output_bytes') is not None:
+            self.observe('image_output_bytes', record['output_bytes'])
+
+    def record_failure(self, exception_type):
+        self.inc('image_failures_total', exception=exception_type)
+
+    def render(self):
+        """Texto en formato de exposición de Prometheus"""
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms} | set(self._gauges))
+        for name in names:
+            full_name = METRIC_PREFIX + name
+            help_text, kind = self._help.get(name, ('', 'untyped'))
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+
+            if name in self._gauges:
+                value = self._gauges[name]()
+                samples = value if isinstance(value, list) else [({}, value)]
+                for labels, sample in samples:
+                    lines.append(f"{full_name}{_format_labels(sorted(labels.items()))} {_format_value(sample)}")
+
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+            for (histogram_name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (('le', _format_value(bound)),)
+                    lines.append(f"{full_name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+METRICS.describe('requests_total', 'Peticiones HTTP por endpoint, método y estado', 'counter')
+METRICS.describe('request_seconds', 'Duración de las peticiones HTTP', 'histogram')
+METRICS.describe('stage_seconds', 'Segundos por etapa de cada conversión', 'histogram')
+METRICS.describe('images_processed_total', 'Imágenes insertadas en documentos', 'counter')
+METRICS.describe('image_failures_total', 'Imágenes que no se pudieron procesar, por tipo de excepción', 'counter')
+METRICS.describe('image_decode_seconds', 'Decodificación de cada imagen', 'histogram')
+METRICS.describe('image_resize_seconds', 'Redimensionado y re-codificación de cada imagen', 'histogram')
+METRICS.describe('image_embed_seconds', 'Inserción de cada imagen en el documento', 'histogram')
+METRICS.describe('image_input_bytes', 'Tamaño de cada imagen recibida', 'histogram', BYTES_BUCKETS)
+METRICS.describe('image_output_bytes', 'Tamaño de cada imagen incrustada', 'histogram', BYTES_BUCKETS)
+
+
+class SlowRequestProfiler:
+    """
+    Perfila peticiones con cProfile y conserva en directory los archivos
+    .pstats de las keep más lentas.
+    """
+
+    def __init__(self, directory, keep=5):
+        self.directory = directory
+        self.keep = keep
+        self._slowest = []  # heap de (segundos, ruta)
+        self._lock = threading.Lock()
+        # cProfile admite un solo perfilador activo a la vez
+        self._active = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """Retorna un cProfile.Profile activo, o None si ya hay otra petición perfilándose"""
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Otro perfilador (p. ej. un depurador) ya está activo
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile, name, seconds):
+        """Detiene el perfilador y guarda el resultado si está entre los más lentos"""
+        profile.disable()
+        self._active.release()
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return None
+            path = os.path.join(self.directory, f"{name}_{int(seconds * 1000)}ms_{time.strftime('%Y%m%d_%H%M%S')}.pstats")
+            profile.dump_stats(path)
+            heapq.heappush(self._slowest, (seconds, path))
+            if len(self._slowest) > self.keep:
+                _, fastest = heapq.heappop(self._slowest)
+                try:
+                    os.remove(fastest)
+                except OSError:
+                    pass
+            return path
@@ -0,0 +1,356 @@
+"""
+Pipeline paralelo de preparación de imágenes.
+
+La decodificación, extracción de metadata, corrección de orientación y el
+redimensionado/re-codificación se ejecutan en un ProcessPoolExecutor. Los
+resultados vuelven en el mismo orden en que se enviaron, para que un único
+hilo los vaya insertando en el documento Word a medida que están listos.
+
+El pool es uno solo por proceso (por cantidad de procesos) y se reutiliza
+entre peticiones. Sus procesos no se crean con fork: el servidor tiene hilos
+(gthread, trabajos, barrido) y hacer fork de un proceso con hilos puede
+bloquear al hijo; con forkserver (spawn en Windows) tampoco se paga el
+arranque del pool en cada petición.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from contextlib import contextmanager
+import multiprocessing
+import os
+import threading
+import time
+
+from PIL import Image
+
+from image_cache import file_digest, info_key, picture_key
+from image_header import read_image_header
+from image_metadata import extract_image_metadata, filename_datetime, read_exif_fields
+from image_source import open_source, source_name, source_size
+from image_prep import (DEFAULT_PROFILE, check_decode_pixels, fit_size, get_profile, oriented_size, prepare_picture,
+                        reduce_decode)
+from layout import DEFAULT_GRID, image_box
+
+# Cantidad de procesos por defecto (0 o 1 = sin pool, todo en el proceso actual)
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Tareas enviadas por adelantado por cada proceso, para no acumular en
+# memoria imágenes ya preparadas que el escritor todavía no consumió
+PREFETCH_PER_WORKER = 2
+
+# Método de inicio de los procesos del pool (forkserver no existe en Windows)
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Pools de este proceso, por cantidad de procesos (ver get_pool)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class StageTimer:
+    """Acumula segundos por etapa del proceso de conversión"""
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, stage, seconds):
+        self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    def merge(self, timings):
+        for stage, seconds in timings.items():
+            self.add(stage, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def report(self):
+        """Resumen legible: 'etapa=123.4ms, ...'"""
+        return ', '.join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.totals.items())
+
+    def server_timing(self):
+        """Valor para la cabecera HTTP Server-Timing"""
+        return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.totals.items())
+
+
+def get_pool(workers):
+    """
+    Pool de workers procesos de este proceso, creado la primera vez y
+    compartido por las llamadas siguientes (también desde otros hilos).
+    Los procesos arrancan a medida que hacen falta
+    """
+    with _pools_lock:
+        executor = _pools.get(workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=multiprocessing.get_context(START_METHOD))
+            _pools[workers] = executor
+        return executor
+
+
+def _discard_pool(workers, executor):
+    # Un pool roto (un proceso murió, p. ej. sin memoria) no acepta más tareas:
+    # la próxima llamada crea otro
+    with _pools_lock:
+        if _pools.get(workers) is executor:
+            del _pools[workers]
+    executor.shutdown(wait=False)
+
+
+def imap_ordered(func, items, workers=DEFAULT_WORKERS):
+    """
+    Aplica func a cada elemento usando un pool de procesos y entrega los
+    resultados en el orden original, a medida que están disponibles.
+
+    Con workers <= 1 (o un solo elemento) se ejecuta en serie en el proceso
+    actual. func debe ser una función de nivel de módulo, o un functools.partial
+    de una (se envía por pickle). Usa el pool compartido de get_pool: si no
+    se consumen todos los resultados, las tareas pendientes se cancelan.
+    """
+    items = list(items)
+    if workers is None:
+        workers = DEFAULT_WORKERS
+
+    if workers <= 1 or len(items) < 2:
+        for item in items:
+            yield func(item)
+        return
+
+    executor = get_pool(workers)
+    prefetch = min(workers, len(items)) * PREFETCH_PER_WORKER
+    pending = deque()
+    remaining = iter(items)
+
+    try:
+        for item in remaining:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= prefetch:
+                break
+
+        while pending:
+            result = pending.popleft().result()
+            next_item = next(remaining, None)
+            if next_item is not None:
+                pending.append(executor.submit(func, next_item))
+            yield result
+    except BrokenProcessPool:
+        _discard_pool(workers, executor)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def build_image_record(item, mode=None, quality=DEFAULT_PROFILE, read_metadata=False, cache=None,
+                       grid=DEFAULT_GRID):
+    """
+    Construye el registro de una imagen abriendo el archivo una sola vez
+    (se ejecuta en un proceso del pool). Con caché, si la misma imagen (por
+    contenido) ya se preparó con la misma caja y perfil, no se abre.
+
+    Args:
+        item: Tupla (filepath, has_caption); filepath es una ruta o una
+            image_source.MemoryImage, y has_caption indica si la imagen lleva
+            fecha encima (reduce la caja disponible en modo recibos)
+        mode: Modo de organización para el que se prepara la imagen
+            (None = no preparar, solo leer dimensiones y metadata)
+        quality: Perfil de calidad de QUALITY_PROFILES
+        read_metadata: Extraer también fecha/remitente (extract_image_metadata)
+        cache: ImageCache opcional (image_cache.py)
+        grid: Cuadrícula del modo recibos (layout.RECEIPT_GRIDS)
+
+    Retorna un diccionario con:
+        filepath, filename, format, width, height: datos del archivo (píxeles,
+            tal como está guardado)
+        orientation: orientación EXIF (1 = normal; 5 a 8 intercambian ancho y alto)
+        digest: SHA1 del archivo (al preparar la imagen o con caché; si no, None)
+        metadata: diccionario de extract_image_metadata (o None)
+        picture: bytes re-codificados, o None para usar el archivo original
+        picture_width, picture_height: tamaño impreso en EMU
+        prepared_for: (mode, quality, grid) con que se preparó la imagen (o None)
+        input_bytes, output_bytes: tamaño del archivo y de lo que se incrusta
+        error, error_type (nombre de la excepción; ImageTooLargeError si la imagen
+            pasa image_prep.MAX_DECODE_PIXELS), timings
+        cache: aciertos/fallos del caché, {'hits': n, 'misses': n}
+    """
+    filepath, has_caption = item
+    timings = {}
+    record = {
+        'filepath': filepath,
+        'filename': source_name(filepath),
+        'digest': None,
+        'format': None,
+        'width': None,
+        'height': None,
+        'orientation': 1,
+        'metadata': None,
+        'picture': None,
+        'picture_width': None,
+        'picture_height': None,
+        'prepared_for': None,
+        'input_bytes': None,
+        'output_bytes': None,
+        'error': None,
+        'error_type': None,
+        'timings': timings,
+        'cache': {'hits': 0, 'misses': 0},
+    }
+
+    try:
+        profile = get_profile(quality)
+        record['input_bytes'] = source_size(filepath)
+        box = image_box(mode, has_caption, grid) if mode is not None else None
+
+        if mode is None:
+            # Solo metadata: basta la cabecera del archivo, sin Pillow. Si el
+            # nombre ya trae la fecha (WhatsApp) ni siquiera se lee el EXIF
+            start = time.perf_counter()
+            read_exif = read_metadata and filename_datetime(record['filename']) is None
+            header = read_image_header(filepath, read_exif)
+            if header is not None:
+                record['format'] = header['format']
+                record['width'], record['height'] = header['width'], header['height']
+                if header['exif'] is not None:
+                    record['orientation'] = header['exif']['orientation']
+                if read_metadata:
+                    exif_fields = header['exif'] or {'datetime': None, 'sender': None, 'orientation': 1}
+                    record['metadata'] = extract_image_metadata(filepath, exif_fields=exif_fields)
+                timings['header'] = time.perf_counter() - start
+                return record
+
+        if cache is not None or mode is not None:
+            # El SHA1 identifica la imagen en el caché y en el manifiesto del documento
+            start = time.perf_counter()
+            digest = file_digest(filepath)
+            record['digest'] = digest
+            timings['hash'] = time.perf_counter() - start
+
+        if cache is not None:
+            start = time.perf_counter()
+            info = cache.get(info_key(digest))
+            cached_picture = None
+            if info is not None and mode is not None:
+                cached_picture = cache.get(picture_key(digest, box, profile))
+            timings['cache'] = time.perf_counter() - start
+
+            if info is not None and (mode is None or cached_picture is not None):
+                record['cache']['hits'] += 1
+                _fill_from_cache(record, info, cached_picture, (mode, quality, grid), read_metadata)
+                return record
+            record['cache']['misses'] += 1
+
+        # Image.open solo lee la cabecera; los píxeles se decodifican más abajo
+        start = time.perf_counter()
+        with open_source(filepath) as f, Image.open(f) as img:
+            record['format'] = img.format
+            record['width'], record['height'] = img.size
+            record['orientation'] = _header_orientation(img)
+            timings['open'] = time.perf_counter() - start
+
+            exif_fields = None
+            if cache is not None or read_metadata:
+                start = time.perf_counter()
+                try:
+                    exif_fields = read_exif_fields(img)
+                except Exception:
+                    pass
+                if read_metadata:
+                    record['metadata'] = extract_image_metadata(filepath, img, exif_fields)
+                timings['metadata'] = time.perf_counter() - start
+
+            if cache is not None and exif_fields is not None:
+                cache.put(info_key(digest), {
+                    'format': record['format'],
+                    'width': record['width'],
+                    'height': record['height'],
+                    'exif': exif_fields,
+                })
+
+            if mode is None:
+                return record
+
+            # El tamaño impreso sale de las dimensiones ya orientadas, sin
+            # decodificar ni rotar: con el perfil original se incrustan los
+            # bytes sin tocar y el visor aplica la orientación EXIF (de un
+            # archivo de varios cuadros, solo el primero; ver prepare_picture)
+            max_width, max_height = box
+            orientation = record['orientation']
+            target_width, target_height = fit_size(*oriented_size(img.width, img.height, orientation),
+                                                   max_width, max_height)
+
+            # Antes de decodificar: decodificar reducido (JPEG) y rechazar las
+            # imágenes que pasan el límite de píxeles. De un GIF animado o un
+            # TIFF multipágina solo se decodifica el primer cuadro
+            start = time.perf_counter()
+            reduced = False
+            multiframe = getattr(img, 'is_animated', False)
+            if profile is not None:
+                reduced = reduce_decode(img, target_width, target_height, profile, orientation)
+                img.load()
+                # En PNG el EXIF puede venir después de los datos (ver _header_orientation)
+                if img.format == 'PNG' and img.getexif().get(0x0112, 1) != orientation:
+                    orientation = record['orientation'] = img.getexif().get(0x0112, 1)
+                    target_width, target_height = fit_size(*oriented_size(img.width, img.height, orientation),
+                                                           max_width, max_height)
+            elif multiframe:
+                check_decode_pixels(img)
+                img.load()
+            timings['decode'] = time.perf_counter() - start
+
+            # La orientación se aplica al redimensionar (prepare_picture), ya reducida
+            start = time.perf_counter()
+            picture = prepare_picture(filepath, img, target_width, target_height, profile,
+                                      reuse_original=not (reduced or multiframe), orientation=orientation)
+            timings['resize'] = time.perf_counter() - start
+
+        record['picture_width'] = target_width
+        record['picture_height'] = target_height
+        record['prepared_for'] = (mode, quality, grid)
+        if picture is not filepath:
+            record['picture'] = picture.getvalue()
+        record['output_bytes'] = _output_bytes(record)
+
+        if cache is not None:
+            cache.put(picture_key(digest, box, profile), {
+                'picture': record['picture'],
+                'picture_width': target_width,
+                'picture_height': target_height,
+            })
+    except Exception as e:
+        record['error'] = str(e)
+        record['error_type'] = type(e).__name__
+
+    return record
+
+
+def _header_orientation(img):
+    # Orientación EXIF sin decodificar la imagen. En PNG getexif() decodifica
+    # para buscar un EXIF ubicado después de los datos: solo se usa el de la
+    # cabecera (si aparece después, se corrige al rotar, ya decodificada)
+    if img.format == 'PNG' and 'exif' not in img.info:
+        return 1
+    return img.getexif().get(0x0112, 1)
+
+
+def _fill_from_cache(record, info, cached_picture, prepared_for, read_metadata):
+    # Completa el registro con las entradas del caché, sin abrir la imagen
+    record['format'] = info['format']
+    record['width'], record['height'] = info['width'], info['height']
+    record['orientation'] = info['exif'].get('orientation', 1)
+    if read_metadata:
+        record['metadata'] = extract_image_metadata(record['filepath'], exif_fields=info['exif'])
+    if cached_picture is not None:
+        # picture None = incrustar el archivo original (mismo contenido)
+        record['picture'] = cached_picture['picture']
+        record['picture_width'] = cached_picture['picture_width']
+        record['picture_height'] = cached_picture['picture_height']
+        record['prepared_for'] = prepared_for
+        record['output_bytes'] = _output_bytes(record)
+
+
+def _output_bytes(record):
+    # Sin bytes preparados se incrusta el archivo original
+    return record['input_bytes'] if record['picture'] is None else len(record['picture'])
@@ -0,0 +1,140 @@
+"""
+Almacén en disco de los documentos ya generados por /convert.
+
+Cada resultado se guarda con la clave de su entrada: el hash de las imágenes
+(contenido y nombre) y de las opciones de conversión (ver result_key). Como
+el .docx es reproducible (docx_writer.py), la misma conversión se sirve desde
+aquí sin volver a armarla, y la clave sirve de ETag (app.py no guarda los
+documentos con pies tomados de la fecha de modificación, que no forma parte
+de la clave). Tamaño acotado, con
+expulsión LRU como image_cache.ImageCache.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from image_cache import file_digest, private_directory
+
+# Cambiar si cambia el documento que se genera, para no servir resultados viejos
+RESULT_VERSION = 4
+
+# Tamaño máximo por defecto del almacén
+DEFAULT_RESULT_BYTES = 1024 * 1024 * 1024
+
+# Extensiones de los resultados: un .docx, o un .zip con varios volúmenes
+RESULT_EXTENSIONS = ('.docx', '.zip')
+
+
+def result_key(file_list, options):
+    """
+    Clave de una conversión: SHA1 de los nombres y el contenido de las
+    imágenes, en el orden recibido, y de las opciones
+    file_list: lista de (filename, filepath); filepath puede ser una
+        image_source.MemoryImage
+    options: diccionario de opciones serializable en JSON
+    """
+    entry = {
+        'version': RESULT_VERSION,
+        'options': options,
+        'images': [[filename, file_digest(filepath)] for filename, filepath in file_list],
+    }
+    return hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+
+
+class ResultStore:
+    """Documentos generados en un directorio, por clave, con tamaño acotado"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_RESULT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Lo que hay aquí se sirve tal cual: el directorio es solo del usuario actual
+        private_directory(directory)
+
+    def get(self, key):
+        """Ruta del resultado guardado con esa clave, o None"""
+        for ext in RESULT_EXTENSIONS:
+            path = os.path.join(self.directory, key + ext)
+            try:
+                # Marcar como usado recientemente (orden LRU)
+                os.utime(path)
+            except OSError:
+                continue
+            with self._lock:
+                self.hits += 1
+            return path
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, path):
+        """
+        Mueve el resultado en path al almacén (escritura atómica).
+        Retorna su nueva ruta; si no se pudo guardar, la del que ya estaba
+        guardado con esa clave o path, sin tocarlo.
+        """
+        target = os.path.join(self.directory, key + os.path.splitext(path)[1])
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                return path
+            # Nombre temporal propio: dos peticiones con la misma clave pueden guardar a la vez
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+        except OSError:
+            return path
+        moved = False
+        try:
+            try:
+                os.replace(path, temp_path)
+                moved = True
+            except OSError:
+                # En otro sistema de archivos: se copia y el original queda hasta terminar
+                shutil.copyfile(path, temp_path)
+            os.replace(temp_path, target)
+        except OSError:
+            try:
+                if moved:
+                    os.replace(temp_path, path)
+                else:
+                    os.remove(temp_path)
+            except OSError:
+                pass
+            # Si otra petición ya lo guardó, se sirve ese; si no, el original
+            return target if os.path.exists(target) else path
+        if not moved:
+            os.remove(path)
+        self.evict()
+        return target
+
+    def evict(self):
+        """Borra los resultados usados hace más tiempo hasta quedar bajo max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(RESULT_EXTENSIONS):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        return removed
@@ -0,0 +1,80 @@
+"""
+Orden de las imágenes en el documento.
+
+- natural_key: orden natural de nombres de archivo (IMG-…-WA2 antes que WA10)
+- date_key: orden por fecha y, con la misma fecha, por nombre
+- SortEntry: registro compacto de una imagen ya ubicada (clave, ruta y fecha
+  del pie), en lugar del registro completo de pipeline.build_image_record
+- merge_sorted: mezcla perezosa de varias secuencias ya ordenadas
+
+En lotes de decenas de miles de imágenes ordenar por fecha solo conserva un
+SortEntry por imagen: el registro con la metadata completa se descarta apenas
+se lee.
+"""
+from datetime import datetime
+from heapq import merge
+from operator import attrgetter
+import re
+
+# Fecha de las imágenes sin fecha: van primero
+UNDATED = datetime(1970, 1, 1)
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def natural_key(name):
+    """
+    Clave de orden natural de un nombre de archivo: los números se comparan
+    por valor y el resto sin distinguir mayúsculas. El nombre completo desempata
+    (IMG1 e img01 quedan siempre en el mismo orden)
+    """
+    parts = _DIGITS.split(name.lower())
+    # Posiciones impares: números; las pares siguen siendo texto, así nunca se comparan str con int
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts), name
+
+
+def date_key(value, name):
+    """
+    Clave de orden por fecha: con la misma fecha (las de WhatsApp son solo
+    del día) decide el nombre en orden natural, así el orden no depende del
+    orden en que llegan las imágenes
+    """
+    return value, natural_key(name)
+
+
+class SortEntry:
+    """
+    Imagen ubicada en el orden del documento: key es su clave de orden,
+    filepath la imagen (ruta o image_source.MemoryImage) y datetime la fecha
+    que se muestra en el pie (None = sin fecha); from_mtime indica que esa
+    fecha es la de modificación del archivo (no estaba en EXIF ni en el nombre)
+    """
+    __slots__ = ('key', 'filepath', 'datetime', 'from_mtime')
+
+    def __init__(self, key, filepath, datetime=None, from_mtime=False):
+        self.key = key
+        self.filepath = filepath
+        self.datetime = datetime
+        self.from_mtime = from_mtime
+
+    def __repr__(self):
+        return f"SortEntry({self.key!r}, {self.filepath!r})"
+
+
+def metadata_entry(record):
+    """SortEntry por fecha de un registro de build_image_record (sin fecha: UNDATED)"""
+    metadata = record['metadata'] or {}
+    value = metadata.get('datetime') or UNDATED
+    return SortEntry(date_key(value, record['filename']), record['filepath'], value,
+                     metadata.get('datetime_source') == 'file_mtime')
+
+
+def merge_sorted(runs, key=attrgetter('key')):
+    """
+    Mezcla varias secuencias ya ordenadas (por defecto de SortEntry) en una
+    sola ordenada, en tiempo lineal. Es perezosa: entrega cada elemento apenas
+    se conoce el primero de cada secuencia, sin materializarlas. Con la misma
+    clave, primero los de la secuencia anterior
+    """
+    return merge(*runs, key=key)
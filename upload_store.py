@@ -0,0 +1,194 @@
+"""
+Almacén de imágenes subidas por partes, identificadas por su SHA1.
+
+El cliente envía primero los hashes de sus archivos (/uploads/check) y solo
+sube los que el servidor no tiene, en partes. Una subida interrumpida se
+retoma desde los bytes ya recibidos. Las conversiones luego referencian las
+imágenes por hash, sin volver a enviarlas: el mismo lote sirve para
+/analyze_metadata y para cada /convert.
+"""
+from contextlib import contextmanager
+import os
+import re
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso (servidor de desarrollo)
+    fcntl = None
+
+from image_cache import file_digest, private_directory
+
+# Segundos que se conserva una imagen (o una subida incompleta) sin usarse
+DEFAULT_UPLOAD_TTL = 24 * 3600
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+class UploadOffsetError(Exception):
+    """La parte recibida no empieza donde termina lo ya subido"""
+
+    def __init__(self, received):
+        super().__init__(f"Se esperaba la parte que empieza en el byte {received}")
+        self.received = received
+
+
+def is_digest(value):
+    """Indica si value es un SHA1 en hexadecimal (minúsculas)"""
+    return isinstance(value, str) and bool(_DIGEST_RE.match(value))
+
+
+class UploadStore:
+    """Imágenes completas en blobs/ y subidas en curso en partial/"""
+
+    def __init__(self, directory, ttl=DEFAULT_UPLOAD_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._blobs = os.path.join(directory, 'blobs')
+        self._partial = os.path.join(directory, 'partial')
+        self._lock = threading.Lock()
+        # Imágenes cuyo contenido ya se verificó en este proceso (ver has)
+        self._verified = set()
+        private_directory(directory)
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._partial, exist_ok=True)
+
+    def _blob_path(self, digest):
+        if not is_digest(digest):
+            raise ValueError(f"Hash no válido: {digest}")
+        return os.path.join(self._blobs, digest)
+
+    def _partial_path(self, digest):
+        if not is_digest(digest):
+            raise ValueError(f"Hash no válido: {digest}")
+        return os.path.join(self._partial, digest)
+
+    @contextmanager
+    def _upload_lock(self, digest):
+        # Exclusión de las escrituras de una misma imagen. Con fcntl, flock
+        # sobre un archivo de bloqueo por hash, entre procesos (varios workers
+        # de gunicorn) y entre hilos (cada uno lo abre por separado); no se
+        # renombra ni se borra al completar la subida, así todos bloquean
+        # siempre el mismo. Sin fcntl (Windows, un solo proceso) un lock del proceso
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+        fd = os.open(self._partial_path(digest) + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Marcar como usado, para que prune no lo borre en una subida larga
+            os.utime(fd)
+            yield
+        finally:
+            os.close(fd)
+
+    def has(self, digest):
+        """
+        Indica si la imagen está completa. La primera vez en cada proceso se
+        verifica su hash: una que no coincide se borra y se vuelve a pedir
+        """
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            return False
+        if digest in self._verified:
+            return True
+        try:
+            if file_digest(blob_path) == digest:
+                self._verified.add(digest)
+                return True
+            os.remove(blob_path)
+        except OSError:
+            pass
+        return False
+
+    def received(self, digest):
+        """Bytes ya recibidos de una imagen (su tamaño si está completa)"""
+        for path in (self._blob_path(digest), self._partial_path(digest)):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                pass
+        return 0
+
+    def check(self, digests):
+        """
+        Retorna {'missing': [...], 'partial': {hash: bytes recibidos}} para
+        los hashes que el cliente todavía tiene que subir (o terminar de subir)
+        """
+        self.prune()
+        missing = []
+        partial = {}
+        for digest in dict.fromkeys(digests):
+            if self.has(digest):
+                continue
+            missing.append(digest)
+            received = self.received(digest)
+            if received:
+                partial[digest] = received
+        return {'missing': missing, 'partial': partial}
+
+    def write_chunk(self, digest, offset, data, total):
+        """
+        Agrega una parte a la subida de digest, empezando en offset.
+        Retorna los bytes recibidos hasta ahora. Al completar total bytes se
+        verifica el hash y la imagen queda disponible.
+        Lanza UploadOffsetError si offset no coincide con lo ya recibido y
+        ValueError si el contenido completo no corresponde al hash.
+        """
+        partial_path = self._partial_path(digest)
+        with self._upload_lock(digest):
+            if self.has(digest):
+                return total
+
+            received = self.received(digest)
+            if offset != received:
+                raise UploadOffsetError(received)
+            if received + len(data) > total:
+                raise ValueError('La parte excede el tamaño total indicado')
+
+            with open(partial_path, 'ab') as f:
+                f.write(data)
+            received += len(data)
+
+            if received == total:
+                if file_digest(partial_path) != digest:
+                    os.remove(partial_path)
+                    raise ValueError('El contenido recibido no coincide con el hash')
+                os.replace(partial_path, self._blob_path(digest))
+                self._verified.add(digest)
+            return received
+
+    def link(self, digest, target_path):
+        """
+        Pone la imagen en target_path (enlace duro si se puede, si no copia).
+        Lanza KeyError si la imagen no está completa en el almacén.
+        """
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            raise KeyError(digest)
+        # Marcar como usada, para que no venza mientras se sigue usando
+        os.utime(blob_path)
+        try:
+            os.link(blob_path, target_path)
+        except OSError:
+            shutil.copyfile(blob_path, target_path)
+
+    def prune(self, now=None):
+        """Borra imágenes y subidas incompletas sin usar hace más de ttl segundos"""
+        if now is None:
+            now = time.time()
+        removed = 0
+        for folder in (self._blobs, self._partial):
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if now - entry.stat().st_mtime > self.ttl:
+                            os.remove(entry.path)
+                            self._verified.discard(entry.name)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed